@@ -8,7 +8,7 @@ from monitor import WorkerThread, EVT_RESULT, EVT_FINISHED
 
 from viewer import ImagePanel, DragState, Marker
 from scan import ScanPanel
-from galvo import DoubleGalvoPanel
+from galvo import DoubleGalvoPanel, GalvoWriter
 from util import get_next_filename
 import wx
 
@@ -22,6 +22,13 @@ class AcquisitionWindow(wx.Frame):
         self.ygalvo = ygalvo
         self.ghost = None
 
+        # galvo moves happen in the background, latest request wins
+        def applied(axis, value):
+            wx.CallAfter(self.on_galvo_moved, axis, value)
+        self.writer = GalvoWriter(xgalvo, ygalvo, callback=applied)
+        self.writer.start()
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
+
         self.make_data_generator = make_data_generator
 
         # statusbar
@@ -103,6 +110,10 @@ class AcquisitionWindow(wx.Frame):
     def OnExit(self, e):
         self.Close(True)
 
+    def OnClose(self, e):
+        self.writer.abort()
+        e.Skip()
+
     def OnOpen(self, e):
         dlg = wx.FileDialog(self,
                 message="Choose a file",
@@ -136,11 +147,15 @@ class AcquisitionWindow(wx.Frame):
         if dlg.ShowModal() == wx.ID_OK:
             self.save_to_dir = dlg.GetDirectory()
             path = dlg.GetPath()
+            # anything else the scan has to save, like per-pixel dwell
+            saved = getattr(self.make_data_generator, 'saved', None)
+            extra = saved() if saved is not None else {}
             n.savez(path,
                     image=self.vector,
                     X=self.X,
                     Y=self.Y,
-                    t=self.t)
+                    t=self.t,
+                    **extra)
             self.statusbar.SetStatusText('Saved %s' % path)
 
     def scangen(self, X, Y, t, **kwargs):
@@ -161,7 +176,12 @@ class AcquisitionWindow(wx.Frame):
         return gen
 
     def on_result(self, event):
-        self.panel.update_data(self.vector)
+        # progressive scans show a filled-in preview until complete
+        preview = getattr(self.make_data_generator, 'preview', None)
+        if preview is not None:
+            self.panel.update_data(preview(self.vector))
+        else:
+            self.panel.update_data(self.vector)
 
     def on_scan_finished(self, event):
         elapsed = timedelta(seconds=int(event.elapsed))
@@ -182,15 +202,18 @@ class AcquisitionWindow(wx.Frame):
         self.galvo.set_values(xloc, yloc)
 
     def set_xgalvo_value(self, value):
-        self.xgalvo.set_value(value)
-        if self.ghost is not None:
-            self.ghost.set_x(value)
-            self.ghost.draw()
+        self.writer.request('x', value)
 
     def set_ygalvo_value(self, value):
-        self.ygalvo.set_value(value)
+        self.writer.request('y', value)
+
+    def on_galvo_moved(self, axis, value):
+        """ gets called once the galvo has actually moved """
         if self.ghost is not None:
-            self.ghost.set_y(value)
+            if axis == 'x':
+                self.ghost.set_x(value)
+            else:
+                self.ghost.set_y(value)
             self.ghost.draw()
 
 
@@ -212,6 +235,13 @@ class FakeGalvoPixel(object):
 
     value = property(get_value, set_value)
 
+    def codes(self, vals):
+        vals = n.asarray(vals, dtype=int)
+        return ((self.factor * vals) % self.max_value).astype(n.int16)
+
+    def set_code(self, code):
+        self._value = (self.factor * code) % self.max_value
+
 
 def main():
     from .config import load_config
@@ -219,18 +249,56 @@ def main():
 
     # galvos
     try:
-        from expt import GalvoPixel
+        from expt import GalvoPixel, GalvoPair, tasks
     except NotImplementedError:
         GalvoPixel = FakeGalvoPixel
-
-    xgalvo = GalvoPixel(cfg.get('galvos', 'xgalvo'))
-    ygalvo = GalvoPixel(cfg.get('galvos', 'ygalvo'))
+        GalvoPair = None
+        tasks = None
+
+    if GalvoPair is not None and cfg.getboolean('galvos', 'paired'):
+        pair = GalvoPair(cfg.get('galvos', 'xgalvo'),
+                         cfg.get('galvos', 'ygalvo'))
+        xgalvo, ygalvo = pair.x, pair.y
+    else:
+        xgalvo = GalvoPixel(cfg.get('galvos', 'xgalvo'))
+        ygalvo = GalvoPixel(cfg.get('galvos', 'ygalvo'))
     pulsechan = cfg.get('counting', 'pulsechan')
     countchan = cfg.get('counting', 'countchan')
+    buffered = cfg.getboolean('counting', 'buffered')
+    sampleclk = cfg.get('counting', 'sampleclk') or None
+    target = cfg.getint('counting', 'target')
+    tick = cfg.getfloat('counting', 'tick')
+    serpentine = cfg.getboolean('galvos', 'serpentine')
+    line_offset = cfg.getint('galvos', 'line_offset')
+    progressive = cfg.getboolean('galvos', 'progressive')
+    refine = cfg.getint('refine', 'factor')
+    threshold = cfg.getfloat('refine', 'threshold')
+    contrast = cfg.getfloat('refine', 'contrast')
+    grow = cfg.getint('refine', 'grow')
+
+    from plan import SettleModel
+    xsettle = SettleModel.from_config(cfg, 'x')
+    ysettle = SettleModel.from_config(cfg, 'y')
+
+    if GalvoPixel is FakeGalvoPixel:
+        buffered = False  # no DAC to time
 
     from slow import make_generator_factory
     make_data_generator = make_generator_factory(xgalvo, ygalvo,
-                                                 pulsechan, countchan)
+                                                 pulsechan, countchan,
+                                                 buffered=buffered,
+                                                 sampleclk=sampleclk,
+                                                 serpentine=serpentine,
+                                                 line_offset=line_offset,
+                                                 progressive=progressive,
+                                                 xsettle=xsettle,
+                                                 ysettle=ysettle,
+                                                 target=target,
+                                                 tick=tick,
+                                                 refine=refine,
+                                                 threshold=threshold,
+                                                 contrast=contrast,
+                                                 grow=grow)
 
     # gui app
     app = wx.App(False)
@@ -240,5 +308,8 @@ def main():
     frame.Show(True)
     app.MainLoop()
 
+    if tasks is not None:
+        tasks.clear()
+
 if __name__ == "__main__":
     main()
@@ -1,7 +1,140 @@
+from __future__ import print_function
 import numpy as n
+from contextlib import contextmanager
 
 # AFG controls
 
+# settings that change when a related one is set, by their first four
+# letters: amplitude, offset, high and low are all views of the same
+# two levels, and a new function can clip the levels and frequency to
+# its own limits
+COUPLED = {
+    'volt': ('volt',),
+    'func': ('volt', 'freq'),
+    }
+
+def split_header(header):
+    """ the (channel prefix, setting) of a SCPI header, in lower case """
+    prefix, sep, rest = header.lower().partition(':')
+    if sep and prefix.startswith('sour'):
+        return prefix, rest
+    return '', header.lower()
+
+class SCPIBus(object):
+    """
+    Wraps a VISA instrument to batch SCPI commands and remember the
+    instrument's settings.
+
+    Inside a ``with bus.batch():`` block, writes are collected and
+    sent as a single write when the block ends. Settings made with
+    ``set()`` are remembered, so that setting a value the instrument
+    already has costs nothing, and ``get()`` answers from memory
+    unless asked to refresh. Writing a setting forgets the ones on the
+    same channel that change along with it (see COUPLED). Anything
+    else is passed straight through to the instrument.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+        self.state = {}
+        self._pending = None
+
+    def __getattr__(self, name):
+        return getattr(self.bus, name)
+
+    def __repr__(self):
+        return 'SCPIBus(%r)' % self.bus
+
+    # the block writer toggles this on the instrument itself
+    send_end = property(lambda self: self.bus.send_end,
+                        lambda self, val: setattr(self.bus, 'send_end', val))
+
+    @contextmanager
+    def batch(self):
+        if self._pending is not None:
+            yield  # already batching
+            return
+        self._pending = []
+        try:
+            yield
+        finally:
+            try:
+                self.flush()
+            finally:
+                self._pending = None
+
+    def flush(self):
+        """ send any batched commands """
+        if self._pending:
+            commands = ';:'.join(self._pending)
+            headers = [c.split(' ', 1)[0] for c in self._pending]
+            del self._pending[:]
+            try:
+                self.bus.write(commands)
+            except Exception:
+                # settings were remembered when they were batched, but
+                # the instrument may not have taken any of them
+                for header in headers:
+                    self._invalidate(header)
+                raise
+
+    def _invalidate(self, header):
+        """ forget `header`, and whatever setting it changes with it """
+        self.state.pop(header, None)
+        channel, setting = split_header(header)
+        coupled = COUPLED.get(setting[:4], ())
+        for key in list(self.state):
+            other_channel, other = split_header(key)
+            if other_channel == channel and other[:4] in coupled:
+                del self.state[key]
+
+    def write(self, command):
+        # we no longer know what this setting is
+        self._invalidate(command.split(' ', 1)[0])
+        if self._pending is not None:
+            self._pending.append(command)
+        else:
+            self.bus.write(command)
+
+    def ask(self, command):
+        self.flush()
+        return self.bus.ask(command)
+
+    def write_raw(self, data):
+        self.flush()
+        return self.bus.write_raw(data)
+
+    def read_raw(self):
+        self.flush()
+        return self.bus.read_raw()
+
+    def set(self, header, value):
+        """ set `header` to `value`, unless it is known to be already """
+        value = str(value)
+        if self.state.get(header, '').upper() == value.upper():
+            return
+        self.write(header + ' ' + value)
+        self.state[header] = value
+
+    def get(self, header, refresh=False):
+        """ the value of `header`, asking the instrument if need be """
+        if refresh or header not in self.state:
+            self.state[header] = self.ask(header + '?').strip()
+        return self.state[header]
+
+    def forget(self):
+        """ forget all settings, e.g. after the front panel was used """
+        self.state.clear()
+
+@contextmanager
+def batched(bus):
+    """ batch commands to `bus` if it is an SCPIBus """
+    if isinstance(bus, SCPIBus):
+        with bus.batch():
+            yield
+    else:
+        yield
+
 class AFG_channel(object):
     """
     Class encapsulating a AFG channel
@@ -18,88 +151,164 @@ class AFG_channel(object):
             prefix = ''
         return prefix + command
 
-    def get_mode(self):
-        return self.bus.ask(self.cmd('func?'))
+    def _get(self, header, refresh=False):
+        if isinstance(self.bus, SCPIBus):
+            return self.bus.get(self.cmd(header), refresh)
+        return self.bus.ask(self.cmd(header + '?'))
+
+    def _set(self, header, val):
+        if isinstance(self.bus, SCPIBus):
+            self.bus.set(self.cmd(header), val)
+        else:
+            self.bus.write(self.cmd(header + ' ' + str(val)))
+
+    def get_mode(self, refresh=False):
+        return self._get('func', refresh)
 
     def set_mode(self, val):
-        self.bus.write(self.cmd('func ' + val))
+        self._set('func', val)
 
     mode = property(get_mode, set_mode)
     """ Output Mode. Can be SIN, SQU, RAMP.
     If arb, specify source: USER1, USER2, USER3, USER4, EMEM """
 
-    def get_freq(self):
-        return float(self.bus.ask(self.cmd('freq?')))
+    def get_freq(self, refresh=False):
+        return float(self._get('freq', refresh))
 
     def set_freq(self, val):
-        self.bus.write(self.cmd('freq ' + str(val)))
+        self._set('freq', val)
 
     freq = property(get_freq, set_freq)
     """ Frequency in Hz """
 
-    def get_amp(self):
-        return float(self.bus.ask(self.cmd('volt?')))
+    def get_amp(self, refresh=False):
+        return float(self._get('volt', refresh))
 
     def set_amp(self, val):
-        self.bus.write(self.cmd('volt ' + str(val)))
+        self._set('volt', val)
 
     amp = property(get_amp, set_amp)
     """ Amplitude in Volts peak to peak """
 
-    def get_offset(self):
-        return float(self.bus.ask(self.cmd('volt:offs?')))
+    def get_offset(self, refresh=False):
+        return float(self._get('volt:offs', refresh))
 
     def set_offset(self, val):
-        self.bus.write(self.cmd('volt:offs ' + str(val)))
+        self._set('volt:offs', val)
 
     offset = property(get_offset, set_offset)
     """ Amplitude offset in Volts """
 
-    def get_high(self):
-        return float(self.bus.ask(self.cmd('volt:high?')))
+    def get_high(self, refresh=False):
+        return float(self._get('volt:high', refresh))
 
     def set_high(self, val):
-        self.bus.write(self.cmd('volt:high ' + str(val)))
+        self._set('volt:high', val)
 
     high = property(get_high, set_high)
     """ Amplitude high in Volts """
 
-    def get_low(self):
-        return float(self.bus.ask(self.cmd('volt:low?')))
+    def get_low(self, refresh=False):
+        return float(self._get('volt:low', refresh))
 
     def set_low(self, val):
-        self.bus.write(self.cmd('volt:low ' + str(val)))
+        self._set('volt:low', val)
 
     low = property(get_low, set_low)
     """ Amplitude low in Volts """
 
-    def get_phase(self):
-        return float(self.bus.ask(self.cmd('phase?')))
+    def get_phase(self, refresh=False):
+        return float(self._get('phase', refresh))
 
     def set_phase(self, val):
-        self.bus.write(self.cmd('phase ' + str(val)))
+        self._set('phase', val)
 
     phase = property(get_phase, set_phase)
     """ Waveform phase in radians """
 
-from io import BytesIO
+# IEEE-488.2 definite-length blocks, as used for waveform transfers:
+# '#', one digit giving the length of the length, the length of the
+# data in bytes, then the data itself (big-endian uint16 here)
+
+BLOCK_DTYPE = n.dtype('>u2')
+
+def block_header(nbytes):
+    """ the definite-length block header announcing `nbytes` of data """
+    digits = str(nbytes)
+    if len(digits) > 9:
+        raise ValueError("%d bytes is too long for a definite-length "
+                         "block" % nbytes)
+    return ('#%d%s' % (len(digits), digits)).encode('ascii')
+
+def block_payload(array):
+    """
+    the bytes of `array` as big-endian uint16, as a memoryview.
+    this only copies if the array isn't big-endian uint16 already.
+    """
+    data = n.ascontiguousarray(array, dtype=BLOCK_DTYPE)
+    return memoryview(data.view(n.uint8))
+
+def decode_block(data, dtype=BLOCK_DTYPE):
+    """
+    parse a definite-length block (as returned by read_raw) into an
+    array, without copying the data.
+    """
+    if data[0:1] != b'#':
+        raise ValueError("not an IEEE-488.2 block: %r" % data[:16])
+    ndigits = data[1:2]
+    if not ndigits.isdigit():
+        raise ValueError("truncated or malformed block header: %r"
+                         % data[:16])
+    ndigits = int(ndigits)
+    if ndigits == 0:
+        raise ValueError("indefinite-length blocks are not supported")
+    start = 2 + ndigits
+    length = data[2:start]
+    if len(length) < ndigits or not length.isdigit():
+        raise ValueError("truncated or malformed block header: %r"
+                         % data[:16])
+    nbytes = int(length)
+    if len(data) < start + nbytes:
+        raise ValueError("truncated block: header announces %d bytes, "
+                         "but only %d arrived"
+                         % (nbytes, len(data) - start))
+    itemsize = n.dtype(dtype).itemsize
+    if nbytes % itemsize:
+        raise ValueError("block of %d bytes is not a whole number of "
+                         "%d-byte values" % (nbytes, itemsize))
+    return n.frombuffer(data, dtype=dtype, count=nbytes // itemsize,
+                        offset=start)
+
+def write_block(bus, command, array, chunk_size=2**16):
+    """
+    send `command` followed by `array` as a definite-length block,
+    `chunk_size` bytes at a time, so that the whole message never
+    has to be assembled in memory. END is only sent with the last
+    chunk.
+    """
+    payload = block_payload(array)
+    head = command + block_header(len(payload))
+    if not hasattr(bus, 'send_end') or not len(payload):
+        bus.write_raw(head + payload.tobytes())
+        return
+    send_end = bus.send_end
+    bus.send_end = False
+    try:
+        bus.write_raw(head)
+        for start in range(0, len(payload), chunk_size):
+            stop = start + chunk_size
+            if stop >= len(payload):
+                bus.send_end = send_end
+            bus.write_raw(payload[start:stop].tobytes())
+    finally:
+        bus.send_end = send_end
 
 def decode_array(data):
-    b = BytesIO(data)
-    assert b.read(1) == b'#'
-    meta_len = int(b.read(1))
-    data_len = int(b.read(meta_len))
-    result = b.read(data_len)
-    array = n.fromstring(result, dtype='>u2')
-    return array
+    return decode_block(data)
 
 def encode_array(array):
-    #assert array.dtype == n.dtype('>u2')
-    data = array.astype('>u2').tostring()
-    data_len = str(len(data))
-    meta_len = str(len(data_len))
-    assert len(meta_len) == 1
-    return b'#' + meta_len + data_len + data
+    payload = block_payload(array)
+    return block_header(len(payload)) + payload.tobytes()
 
 class Arb(object):
     """
@@ -152,11 +361,10 @@ class Arb(object):
     def get_data(self):
         self.bus.write('data:data? emem')
         data = self.bus.read_raw()
-        return decode_array(data)
+        return decode_block(data)
 
     def set_data(self, array):
-        block = encode_array(array)
-        self.bus.write_raw(b'data:data emem,' + block)
+        write_block(self.bus, b'data:data emem,', array)
 
     def get_point(self, index):
         self.bus.write('data:value? emem,%d' % index)
@@ -172,3 +380,31 @@ class Arb(object):
         #register is either USER1, USER2, etc.
         self.bus.write('data:copy emem,%s' % register)
 
+
+
+def benchmark_codec(npts=131072, repeat=20):
+    """
+    time encoding and decoding a waveform of `npts` points,
+    printing milliseconds per transfer.
+    """
+    from timeit import timeit
+
+    class NullBus(object):
+        send_end = True
+        def write_raw(self, data):
+            pass
+
+    bus = NullBus()
+    wave = (n.arange(npts) % Arb.YMAX).astype(n.uint16)
+    reply = encode_array(wave)
+
+    def report(label, func):
+        ms = 1e3 * timeit(func, number=repeat) / repeat
+        print('%-8s %8.3f ms' % (label, ms))
+
+    print('%d-point transfers:' % npts)
+    report('encode', lambda: write_block(bus, b'data:data emem,', wave))
+    report('decode', lambda: decode_block(reply))
+
+if __name__ == "__main__":
+    benchmark_codec()
@@ -13,15 +13,56 @@ def load_default_config():
     config.add_section('galvos')
     config.set('galvos', 'xgalvo',  'Dev2/ao0')
     config.set('galvos', 'ygalvo',  'Dev2/ao1')
+    # drive both galvos from one two-channel DAC task
+    config.set('galvos', 'paired',  'no')
+    # scan alternate lines backward, with the backward lines shifted
+    # by line_offset DAC codes to make up for galvo lag
+    config.set('galvos', 'serpentine',  'no')
+    config.set('galvos', 'line_offset',  '0')
+    # scan a sparse grid first, then fill it in, coarse to fine
+    config.set('galvos', 'progressive',  'no')
     config.add_section('counting')
     config.set('counting', 'pulsechan',  'Dev1/ctr1')
     config.set('counting', 'countchan',  'Dev1/ctr0')
+    # hardware-timed scanning. leave sampleclk blank to clock the
+    # counter from the DAC's own sample clock
+    config.set('counting', 'buffered',  'no')
+    config.set('counting', 'sampleclk',  '')
+    # adaptive dwell: stop counting each pixel once it has `target`
+    # counts (0 to always count the full dwell), checking every `tick`
+    # seconds. uses pulsechan as the clock
+    config.set('counting', 'target',  '0')
+    config.set('counting', 'tick',  '1e-4')
+    # galvo settling time after each move: fixed seconds, plus
+    # per_code seconds for every DAC code moved. x_fixed, y_per_code
+    # and so on override these for one galvo
+    config.add_section('settle')
+    config.set('settle', 'fixed',  '0')
+    config.set('settle', 'per_code',  '0')
+    # region-adaptive scanning: scan every factor-th pixel first (0 to
+    # scan everything), then fill in at full resolution only around
+    # pixels brighter than threshold (counts/s), or differing from
+    # their neighbours' mean by more than contrast times it, and
+    # `grow` coarse pixels beyond
+    config.add_section('refine')
+    config.set('refine', 'factor',  '0')
+    config.set('refine', 'threshold',  '0')
+    config.set('refine', 'contrast',  '0.5')
+    config.set('refine', 'grow',  '1')
+    config.add_section('monitor')
+    # the most times a second to redraw the monitor plot
+    config.set('monitor', 'max_fps',  '30')
     config.add_section('fast')
     config.set('fast', 'pulsechan',  'Dev1/ctr2')
     config.set('fast', 'countchan',  'Dev1/ctr0')
     config.set('fast', 'sampleclk',  'PFI34')
     config.set('fast', 'det_afg',  'GPIB::11')
     config.set('fast', 'rf_afg',  'GPIB::10')
+    # combine repeated frames: none, sum, ema or boxcar. alpha is the
+    # weight of each new frame for ema, navg the depth of the boxcar
+    config.set('fast', 'accumulate',  'none')
+    config.set('fast', 'alpha',  '0.1')
+    config.set('fast', 'navg',  '8')
     return config
 
 def load_config(path=None):
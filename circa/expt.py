@@ -1,10 +1,73 @@
 from __future__ import print_function
 import sys
 import time
+import itertools
 import PyDAQmx as daq
 from PyDAQmx import uInt32, int32, int16, byref
+import numpy as n
 from contextlib import contextmanager
 
+# ---------
+# TASK POOL
+# ---------
+
+class TaskPool(object):
+    """
+    A registry of DAQmx tasks, keyed by physical channel and
+    configuration.
+
+    Creating and verifying a task takes a good fraction of a second
+    on USB devices, so tasks are created and committed once, then
+    handed out again whenever the same configuration is asked for.
+    ``hits`` and ``misses`` count how often that happens. Call
+    ``clear()`` on shutdown to release the hardware.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, factory, *args, **kwargs):
+        """
+        Return the task stored under `key`, or make one by calling
+        `factory` with the remaining arguments, commit it and store it.
+        """
+        try:
+            task = self.tasks[key]
+        except KeyError:
+            self.misses += 1
+            # a pooled task on the same channels would stop this one
+            # from committing
+            for channel in key[1:]:
+                self.unreserve(channel)
+            task = factory(*args, **kwargs)
+            task.TaskControl(daq.DAQmx_Val_Task_Commit)
+            self.tasks[key] = task
+        else:
+            self.hits += 1
+        return task
+
+    def unreserve(self, channel):
+        """
+        free up `channel` for use by a task outside the pool. Pooled
+        tasks using it get reserved again the next time they start.
+        """
+        for key, task in self.tasks.items():
+            if channel in key[1:]:
+                task.TaskControl(daq.DAQmx_Val_Task_Unreserve)
+
+    def clear(self):
+        """ stop and clear every task in the pool """
+        for task in self.tasks.values():
+            try:
+                task.ClearTask()
+            except daq.DAQError as e:
+                print(str(e), file=sys.stderr)
+        self.tasks.clear()
+
+tasks = TaskPool()
+
 # --------------
 # COUNTING STUFF
 # --------------
@@ -27,6 +90,42 @@ def make_counter(countchan, trig=None):
 
     return ctr
 
+def make_buffered_counter(samps, countchan, sampleclk, trig=None,
+                          rate=10000, continuous=False):
+    """
+    Configure the given counter to latch its count into a buffer on
+    every edge of `sampleclk`, for `samps` samples. `rate` is the
+    fastest the sample clock is expected to run, in Hz.
+
+    If `continuous` is True, the counter keeps sampling until stopped,
+    and `samps` sets the size of the buffer instead.
+    """
+    if continuous:
+        mode = daq.DAQmx_Val_ContSamps
+    else:
+        mode = daq.DAQmx_Val_FiniteSamps
+
+    ctr = daq.Task()
+    ctr.CreateCICountEdgesChan(countchan, "",
+                               daq.DAQmx_Val_Rising,
+                               0,  # initial count
+                               daq.DAQmx_Val_CountUp)
+
+    # configure sample clock (http://www.ni.com/white-paper/5404/en/)
+    ctr.CfgSampClkTiming(sampleclk,   # source of the sample clock
+                         rate,        # max rate of the sample clock
+                         daq.DAQmx_Val_Rising,       # activeEdge
+                         mode,                       # sampleMode
+                         samps)                    # sampsPerChanToAcquire
+
+    if trig is not None:
+        # configure pause trigger
+        ctr.SetPauseTrigType(daq.DAQmx_Val_DigLvl)
+        ctr.SetDigLvlPauseTrigSrc(trig)
+        ctr.SetDigLvlPauseTrigWhen(daq.DAQmx_Val_Low)
+
+    return ctr
+
 def make_pulse(duration, pulsechan):
     """
     Configure the counter `pulsechan` to output
@@ -41,6 +140,25 @@ def make_pulse(duration, pulsechan):
     )
     return pulse
 
+def make_clock(rate, pulsechan):
+    """
+    Configure the counter `pulsechan` to output a continuous
+    train of pulses at `rate` (in Hz).
+    """
+    clk = daq.Task()
+    clk.CreateCOPulseChanFreq(
+        pulsechan, "",            # physical channel, name to assign
+        daq.DAQmx_Val_Hz,        # units: Hz
+        daq.DAQmx_Val_Low,       # idle state: low
+        0.00, rate, .5,          # initial delay, frequency, duty cycle
+    )
+    clk.CfgImplicitTiming(daq.DAQmx_Val_ContSamps, 1000)
+    return clk
+
+def internal_output(pulsechan):
+    """ the terminal carrying the output of counter `pulsechan` """
+    return "/%sInternalOutput" % pulsechan.replace('ctr', 'Ctr')
+
 def configure_counter(duration=.1,
                       pulsechan="Dev1/ctr1",
                       countchan="Dev1/ctr0"):
@@ -50,15 +168,19 @@ def configure_counter(duration=.1,
     using the paired counter `pulsechan` to gate the detection
     """
 
-    # configure pulse (for hardware timing)
-    pulse = make_pulse(duration, pulsechan)
+    # configure pulse (for hardware timing). one task per channel,
+    # reprogrammed for the duration at hand
+    pulse = tasks.get(('pulse', pulsechan),
+                      make_pulse, duration, pulsechan)
+    pulse.SetCOPulseHighTime(pulsechan, duration)
 
     # if these are paired counters, we can use the internal output
     # of the pulsing channel to trigger the counting channel
-    trigchan = "/%sInternalOutput" % pulsechan.replace('ctr', 'Ctr')
+    trigchan = internal_output(pulsechan)
 
     # configure counter
-    ctr = make_counter(countchan, trig=trigchan)
+    ctr = tasks.get(('counter', countchan, trigchan),
+                    make_counter, countchan, trig=trigchan)
 
     return pulse, ctr
 
@@ -130,6 +252,235 @@ def gen_count_rate(t=0.1, **kwargs):
         y = do_count(p,c)/t
         yield time.time() - start, y
 
+def stream_counts(ctr, nsamps, timeout=10.):
+    """
+    Read a running, continuously sampled counter `nsamps` samples at
+    a time, yielding the counts collected in each sample period.
+    """
+    data = n.zeros((nsamps + 1,), dtype=n.uint32)
+    # the first sample covers however long it took to start the
+    # clock, so it only serves as the reference for the next
+    read_counts(ctr, data[-1:], timeout)
+    while True:
+        data[0] = data[-1]
+        read_counts(ctr, data[1:], timeout)
+        # unsigned difference is correct across rollover
+        yield n.diff(data)
+
+def gen_count_stream(t=0.001, nsamps=100,
+                     pulsechan="Dev1/ctr1", countchan="Dev1/ctr0"):
+    """
+    Continuous, gap-free version of gen_count_rate.
+
+    The counter `countchan` is sampled every `t` seconds by a pulse
+    train from `pulsechan`, and read in blocks of `nsamps` samples.
+    Yields (times, rates) arrays for each block, with times taken
+    from the sample clock rather than the computer's.
+    """
+    rate = 1. / t
+    clk = make_clock(rate, pulsechan)
+    ctr = make_buffered_counter(10 * nsamps, countchan,
+                                internal_output(pulsechan),
+                                rate=rate, continuous=True)
+    ctr.StartTask()
+    clk.StartTask()
+    try:
+        start = 0
+        for counts in stream_counts(ctr, nsamps, 10. + nsamps * t):
+            times = (start + n.arange(1, nsamps + 1)) * t
+            start += nsamps
+            yield times, counts / t
+    finally:
+        clk.ClearTask()
+        ctr.ClearTask()
+
+def adaptive_scan(gen, target, tmax=0.1, tick=1e-4,
+                  pulsechan="Dev1/ctr1", countchan="Dev1/ctr0"):
+    """
+    Like scan, but each step is counted only until `target` counts
+    have come in, or for `tmax` seconds at most. Yields (rate, dwell)
+    for each step.
+
+    The counter runs continuously, latching its count every `tick`
+    seconds off a clock made on `pulsechan`, and is read as the
+    samples come in; dwell times are whole numbers of ticks. Samples
+    taken while the galvos move (or settle) are thrown away.
+    """
+    rate = 1. / tick
+    maxticks = max(1, int(round(tmax * rate)))
+    timeout = 10. + tmax
+
+    # the pooled counting tasks use the same counters
+    tasks.unreserve(pulsechan)
+    tasks.unreserve(countchan)
+
+    clk = make_clock(rate, pulsechan)
+    bufsize = max(10000, 4 * maxticks)
+    ctr = make_buffered_counter(bufsize, countchan,
+                                internal_output(pulsechan),
+                                rate=rate, continuous=True)
+    data = n.zeros((maxticks + 1,), dtype=n.uint32)
+    counts = n.zeros((maxticks,), dtype=n.uint32)
+    spare = n.zeros((bufsize,), dtype=n.uint32)
+    avail = uInt32()
+
+    def available():
+        ctr.GetReadAvailSampPerChan(byref(avail))
+        return avail.value
+
+    ctr.StartTask()
+    clk.StartTask()
+    try:
+        for step in gen:
+            # drop whatever came in while the galvos were moving, and
+            # the tick in progress. the last sample dropped is the
+            # count this step starts from
+            skip = available() + 1
+            while skip:
+                chunk = min(skip, bufsize)
+                read_counts(ctr, spare[:chunk], timeout)
+                skip -= chunk
+            data[0] = spare[chunk - 1]
+            got = 0
+            while got < maxticks:
+                want = min(max(available(), 1), maxticks - got)
+                new = slice(got, got + want)
+                read_counts(ctr, data[1:][new], timeout)
+                # unsigned difference is correct across rollover
+                n.subtract(data[1:][new], data[:1], out=counts[new])
+                got += want
+                if counts[got - 1] >= target:
+                    break
+            k = min(n.searchsorted(counts[:got], target), got - 1)
+            dwell = (k + 1) * tick
+            yield counts[k] / dwell, dwell
+    except daq.DAQError as e:
+        print(str(e), file=sys.stderr)
+    finally:
+        clk.ClearTask()
+        ctr.ClearTask()
+
+# ---------------------
+# HARDWARE-TIMED RASTER
+# ---------------------
+
+def make_waveform_dac(names, rate, samps, sampleclk=""):
+    """
+    Configure the DAC channels `names` (e.g. "Dev2/ao0,Dev2/ao1") to
+    output `samps` samples per channel at `rate` samples per second,
+    timed by the onboard sample clock unless `sampleclk` is given.
+    """
+    ao = daq.Task()
+    ao.CreateAOVoltageChan(
+        names, "",                    # physical channels, name to assign
+        0., 5., daq.DAQmx_Val_Volts,  # max, min, in units: Volts
+        None)                         # not using custom scale
+    ao.CfgSampClkTiming(sampleclk, rate,
+                        daq.DAQmx_Val_Rising,
+                        daq.DAQmx_Val_FiniteSamps,
+                        samps)
+    return ao
+
+def write_waveform(ao, codes):
+    """
+    Write raw DAC codes to a sample-clocked task, without starting it.
+    `codes` has one row per channel.
+    """
+    codes = n.ascontiguousarray(codes, dtype=n.int16)
+    samps = codes.shape[-1]
+    written = int32()
+    ao.WriteBinaryI16(
+        samps, False, 10.0,           # samples per chan, autostart, timeout
+        daq.DAQmx_Val_GroupByChannel, # one row per channel
+        codes,                        # data to actually write!
+        byref(written),               # output: samples per chan written
+        None)                         # reserved
+    assert written.value == samps
+
+def read_counts(ctr, data, timeout=10.):
+    """ fill the uint32 array `data` from a buffered counter """
+    samps = data.size
+    read = int32()
+    ctr.ReadCounterU32(samps,  # number of samples to read
+                       timeout,
+                       data,   # readArray
+                       samps,  # arraySizeInSamps
+                       byref(read), # sampsPerChanRead
+                       None)   # reserved
+    assert read.value == samps
+    return data
+
+def buffered_scan(plan, t, xgalvo, ygalvo, countchan,
+                  sampleclk=None, frame=False):
+    """
+    Run the ScanPlan `plan` as a hardware-timed waveform, yielding an
+    array of count rates for each of its lines.
+
+    The X and Y codes go out as one sample-clocked waveform on both
+    DAC channels, and the counter `countchan` latches its count on
+    every tick of the same clock, so each pixel is exposed for exactly
+    `t` seconds with no software in the loop. If `frame` is False, one
+    waveform is written per line; if True, the whole frame is written
+    at once and read back a line at a time.
+
+    The counter samples the DAC's sample clock, unless some other
+    terminal is given as `sampleclk`.
+
+    Steps that need time to settle (see plan.SettleModel) are held for
+    extra ticks, and only the last tick of each step is counted.
+    """
+    names = '%s,%s' % (xgalvo.channel, ygalvo.channel)
+    if sampleclk is None:
+        sampleclk = '/%s/ao/SampleClock' % xgalvo.channel.split('/')[0]
+
+    # each line holds its last sample for one extra tick, so that the
+    # counter latches the end of the last pixel
+    reps = plan.ticks(t)
+    codes = n.array((plan.held(plan.xcodes, reps),
+                     plan.held(plan.ycodes, reps)))
+    ends = n.concatenate(([0], n.cumsum(reps)))  # tick each step ends on
+    lines = ends[plan.lines] + n.arange(plan.nlines + 1)
+    # per line, where in the line's buffer each pixel's last tick ends
+    pixels = [ends[line.start + 1:line.stop + 1] - ends[line.start]
+              for line in plan.line_slices()]
+
+    if frame:
+        segments = [(0, plan.nlines)]
+    else:
+        segments = [(k, k + 1) for k in range(plan.nlines)]
+    samps = max(lines[stop] - lines[start] for start, stop in segments)
+
+    # release the galvo channels for the duration of the scan
+    xgalvo.release()
+    ygalvo.release()
+    tasks.unreserve(countchan)
+
+    rate = 1. / t
+    ao = make_waveform_dac(names, rate, samps)
+    ctr = make_buffered_counter(samps, countchan, sampleclk, rate=rate)
+    data = n.zeros((samps,), dtype=n.uint32)
+    try:
+        for start, stop in segments:
+            nsamps = lines[stop] - lines[start]
+            ao.CfgSampClkTiming("", rate, daq.DAQmx_Val_Rising,
+                                daq.DAQmx_Val_FiniteSamps, nsamps)
+            ctr.CfgSampClkTiming(sampleclk, rate, daq.DAQmx_Val_Rising,
+                                 daq.DAQmx_Val_FiniteSamps, nsamps)
+            write_waveform(ao, codes[:, lines[start]:lines[stop]])
+            ctr.StartTask()
+            ao.StartTask()
+            for k in range(start, stop):
+                buf = data[:lines[k+1] - lines[k]]
+                read_counts(ctr, buf, 10. + buf.size * t)
+                last = pixels[k]
+                # unsigned difference is correct across rollover
+                yield (buf[last] - buf[last - 1]) / t
+            ao.StopTask()
+            ctr.StopTask()
+    finally:
+        ao.ClearTask()
+        ctr.ClearTask()
+
 # ---------------
 # PULSED COUNTING
 # ---------------
@@ -141,7 +492,67 @@ def get_counts(ctr):
     ctr.StopTask()
     return count.value
 
-def gen_gated_counts(t=0.1):
+def calibrate_settle(xgalvo, ygalvo, countchan, X, y, t=1e-4,
+                     jumps=(16, 64, 256, 1024, 4095), repeats=20,
+                     tol=3., sampleclk=None, axis='x'):
+    """
+    Estimate a plan.SettleModel for the x galvo from test scans of the
+    line X at height y, which should cross some structure (an edge, or
+    a bright spot) near its start.
+
+    With `axis` 'y', the galvos swap roles, and the estimate is for
+    the y galvo: X is then a column of y positions, scanned at x
+    position y.
+
+    For each size in `jumps`, the line is scanned straight after a
+    jump of that many codes onto its first pixel, and compared with
+    the line scanned after the galvo has had plenty of time to settle.
+    The time until they agree, to within `tol` standard deviations, is
+    fitted as fixed + per_code * jump. Jumps that don't fit on either
+    side of the first pixel go as far as the DAC allows, and are
+    fitted by the distance actually moved.
+    """
+    from .plan import ScanPlan, SettleModel
+    if axis == 'y':
+        xgalvo, ygalvo = ygalvo, xgalvo
+    X = n.asarray(X)
+    rest = max(1, int(.05 / t))  # ticks to sit still before each line
+    run = 4  # pixels in a row that must agree for the galvo to be settled
+
+    def mean_line(start):
+        # park on `start` for a while, then jump onto the line
+        plan = ScanPlan(n.concatenate((n.repeat(start, rest), X)), [y],
+                        xgalvo, ygalvo)
+        total = n.zeros(len(X))
+        for k in range(repeats):
+            for rates in buffered_scan(plan, t, xgalvo, ygalvo, countchan,
+                                       sampleclk=sampleclk):
+                total += rates[rest:] * t
+        return total / repeats  # mean counts per pixel
+
+    ref = mean_line(X[0])
+    noise = n.sqrt(n.maximum(ref, 1) / repeats)
+    top = xgalvo.max_value - 1
+    moves = []
+    times = []
+    for jump in jumps:
+        # codes wrap, so keep the start on the DAC's range
+        if X[0] >= jump:
+            start = X[0] - jump
+        elif X[0] + jump <= top:
+            start = X[0] + jump
+        else:
+            start = 0 if X[0] > top - X[0] else top
+        moves.append(abs(start - X[0]))
+        agree = n.abs(mean_line(start) - ref) <= tol * noise
+        settled = n.convolve(agree, n.ones(run), 'valid') == run
+        times.append((n.argmax(settled) if settled.any() else len(X)) * t)
+    per_code, fixed = n.polyfit(moves, times, 1)
+    return SettleModel(max(fixed, 0.), max(per_code, 0.))
+
+def gen_gated_counts(t=0.1, nsamps=1,
+                     photonchan="Dev2/ctr2", gate="/Dev2/PFI5",
+                     gatechan="Dev2/ctr3", clockchan="Dev2/ctr0"):
     """
     equivalent of gen_count_rate when something else (e.g. a spincore
     sequence) is gating the detection, not a pulse we generate
@@ -150,30 +561,54 @@ def gen_gated_counts(t=0.1):
     This counts both photons and gate edges, and returns the rate as
     photons collected per gated detection period. Divide by the width
     of the window to get counts per second.
+
+    Both counters are sampled together every `t` seconds by a pulse
+    train from `clockchan`, and read in blocks of `nsamps` samples;
+    yields (times, rates) arrays like gen_count_stream.
     """
+    # the default paths here are for andrew's setup
+    rate = 1. / t
+    sampleclk = internal_output(clockchan)
+    clk = make_clock(rate, clockchan)
     # photon counter
-    pc = make_counter("Dev2/ctr2", trig="/Dev2/PFI5")
+    pc = make_buffered_counter(10 * nsamps, photonchan, sampleclk,
+                               trig=gate, rate=rate, continuous=True)
     # and the gate counter:
-    gc = make_counter("Dev2/ctr3")
-    # the paths here are for andrew's setup, hardcoded for now (sorry)
+    gc = make_buffered_counter(10 * nsamps, gatechan, sampleclk,
+                               rate=rate, continuous=True)
 
-    start = time.time()
-    while True:
-        gc.StartTask() # start both counters. this isn't
-        pc.StartTask() # exactly synchronous (error source)
-        time.sleep(t)
-        photons = get_counts(pc)
-        pulses  = get_counts(gc)
-        if pulses:
-            rate = photons / float(pulses)
-        else:
-            rate = 0.
-        yield time.time() - start, rate
+    gc.StartTask() # start both counters. they only latch on
+    pc.StartTask() # clock edges, so they stay in step
+    clk.StartTask()
+    timeout = 10. + nsamps * t
+    try:
+        start = 0
+        for photons, pulses in itertools.izip(
+                stream_counts(pc, nsamps, timeout),
+                stream_counts(gc, nsamps, timeout)):
+            rates = photons / n.maximum(pulses, 1).astype(float)
+            times = (start + n.arange(1, nsamps + 1)) * t
+            start += nsamps
+            yield times, rates
+    finally:
+        clk.ClearTask()
+        pc.ClearTask()
+        gc.ClearTask()
 
 # ---------------
 # SCANNING MIRROR
 # ---------------
 
+def make_dac(*names):
+    """ Configure the given DAC channels for untimed output. """
+    ao = daq.Task()
+    for name in names:
+        ao.CreateAOVoltageChan(
+            name, "",                     # physical channel, name to assign
+            0., 5., daq.DAQmx_Val_Volts,  # max, min, in units: Volts
+            None)                         # not using custom scale
+    return ao
+
 def set_DAC_bits(num, channel_name="Dev2/ao0"):
     """
     Set the DAC bits to the given value (provide an integer between 0 and 2**12)
@@ -184,11 +619,7 @@ def set_DAC_bits(num, channel_name="Dev2/ao0"):
 class DACChannel(object):
     """ encapsulates a DAC channel"""
     def __init__(self, name="Dev2/ao0"):
-        self.ao = daq.Task()
-        self.ao.CreateAOVoltageChan(
-            name, "",                     # physical channel, name to assign
-            0., 5., daq.DAQmx_Val_Volts,  # max, min, in units: Volts
-            None)                         # not using custom scale
+        self.ao = tasks.get(('dac', name), make_dac, name)
 
         # no timing (seems to be 1ms per sample)
         self.name = name
@@ -231,3 +662,109 @@ class GalvoPixel(object):
         self._value = int(val) % self.max_value
 
     value = property(get_value, set_value)
+
+    def codes(self, vals):
+        """ the raw DAC codes for an array of values """
+        vals = n.asarray(vals, dtype=int)
+        return ((self.factor * vals) % self.max_value).astype(n.int16)
+
+    def set_code(self, code):
+        """ write a raw DAC code, as computed by codes() """
+        self.dc.set_value(code)
+        self._value = (self.factor * code) % self.max_value
+
+    @property
+    def channel(self):
+        return self.dc.name
+
+    def release(self):
+        """ free up the DAC channel for use by another task """
+        self.dc.ao.TaskControl(daq.DAQmx_Val_Task_Unreserve)
+
+
+class DualDACChannel(object):
+    """ encapsulates two DAC channels, written together by one task """
+    def __init__(self, xname="Dev2/ao0", yname="Dev2/ao1"):
+        self.ao = tasks.get(('dac', xname, yname), make_dac, xname, yname)
+
+        # no timing. one write updates both channels, for the
+        # same ~1ms that DACChannel takes to update one
+        self.names = (xname, yname)
+        self._values = (None, None)
+
+    def get_values(self):
+        return self._values
+
+    def set_values(self, xval, yval):
+        written = int32()
+        samples = (int16 * 2)(xval, yval)
+        self.ao.WriteRaw(
+            1, True, 10.0,            # samples per channel, autostart, timeout
+            samples,                  # data to actually write! (x, y)
+            byref(written),           # output: samples per channel written
+            None)                     # reserved
+
+        # verify that we wrote all the samples
+        assert written.value == 1
+
+        self._values = (int(xval), int(yval))
+
+
+class GalvoPair(object):
+    """
+    encapsulates a pair of Galvonometers sharing one two-channel DAC
+    task, so that moving both costs a single write.
+
+    The ``x`` and ``y`` attributes behave like a pair of GalvoPixels,
+    and can be used in their place. Moving one axis rewrites the
+    other at its current position, in the same write.
+    """
+    def __init__(self, xname="Dev2/ao0", yname="Dev2/ao1", bits=12,
+                 xreverse=False, yreverse=False):
+        self.dc = DualDACChannel(xname, yname)
+        self.x = PairedGalvo(self, xname, bits, xreverse)
+        self.y = PairedGalvo(self, yname, bits, yreverse)
+
+    def set_codes(self, xcode, ycode):
+        """ write raw DAC codes to both channels at once """
+        self.dc.set_values(xcode, ycode)
+        self.x._code = xcode
+        self.y._code = ycode
+
+    def set_values(self, xval, yval):
+        self.set_codes(int(self.x.codes(xval)), int(self.y.codes(yval)))
+
+
+class PairedGalvo(object):
+    """ one axis of a GalvoPair """
+    def __init__(self, pair, name, bits=12, reverse=False):
+        self.pair = pair
+        self.channel = name
+        self.max_value = 2**bits
+        self.factor = -1 if reverse else 1
+        # until told otherwise, the other axis is written at mid-scale
+        self._code = self.max_value // 2
+
+    def get_value(self):
+        return (self.factor * self._code) % self.max_value
+
+    def set_value(self, val):
+        self.set_code(int(self.codes(val)))
+
+    value = property(get_value, set_value)
+
+    def codes(self, vals):
+        """ the raw DAC codes for an array of values """
+        vals = n.asarray(vals, dtype=int)
+        return ((self.factor * vals) % self.max_value).astype(n.int16)
+
+    def set_code(self, code):
+        """ write a raw DAC code, as computed by codes() """
+        if self is self.pair.x:
+            self.pair.set_codes(code, self.pair.y._code)
+        else:
+            self.pair.set_codes(self.pair.x._code, code)
+
+    def release(self):
+        """ free up the DAC channels for use by another task """
+        self.pair.dc.ao.TaskControl(daq.DAQmx_Val_Task_Unreserve)
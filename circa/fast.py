@@ -1,6 +1,9 @@
+import threading
+import hashlib
+from ctypes import c_long
 import numpy as n
 
-from .afg import AFG_channel, Arb
+from .afg import AFG_channel, Arb, SCPIBus, batched
 
 def sync(length, amp=16382):
     s = n.zeros((length,), dtype=n.uint16)
@@ -15,6 +18,9 @@ def pairify(a):
     """ return an array that's twice as long, with each value duplicated"""
     return n.asarray((a,a)).T.ravel()
 
+# the AFGs hold at most this many points per waveform
+MAXPTS = 2**17
+
 def make_waveforms(X, Y, zigzag=False):
 
     x = pairify(n.array(X, dtype=n.uint16))
@@ -22,44 +28,192 @@ def make_waveforms(X, Y, zigzag=False):
 
     X,Y = n.meshgrid(x,y)
 
-    assert X.size == Y.size <= 2**17
+    assert X.size == Y.size <= MAXPTS
 
     if zigzag:
         zigzagify(X)
 
     return X.ravel(), Y.ravel(), sync(X.size)
 
-# load it
+# keep track of it
 
-def make_and_load_waveforms(X, Y, t, det_afg, rf_afg):
-    det_arb = Arb(det_afg)
-    rf_arb = Arb(rf_afg)
+def grid_key(X, Y, zigzag=False):
+    """ a hash identifying the waveforms for a scan grid """
+    h = hashlib.sha1()
+    for a in (X, Y):
+        a = n.ascontiguousarray(a, dtype=n.uint16)
+        h.update(str(a.shape).encode())
+        h.update(a.view(n.uint8))
+    h.update(b'zigzag' if zigzag else b'raster')
+    return h.hexdigest()
 
-    s_ch = AFG_channel(det_afg, 1)
-    y_ch = AFG_channel(det_afg, 2)
-    x_ch = AFG_channel(rf_afg)
+class ArbMemory(object):
+    """
+    Keeps track of the waveform held in each arbitrary memory register
+    (emem, user1-user4) of one AFG, so that waveforms are only sent
+    over the bus when the instrument doesn't already have them.
 
-    X,Y,s = make_waveforms(X, Y)
+    Each uploaded waveform is also kept in the least recently used
+    user register not listed in `reserved`, so that switching back to
+    it later is a quick copy instead of an upload.
+    """
+
+    USER = ('user1', 'user2', 'user3', 'user4')
+
+    def __init__(self, arb, reserved=()):
+        self.arb = arb
+        self.contents = {}  # register -> key
+        # spare registers, least recently used first
+        self.spare = [r for r in self.USER if r not in reserved]
+
+    def _touch(self, register):
+        if register in self.spare:
+            self.spare.remove(register)
+            self.spare.append(register)
+
+    def load(self, key, make_data, keep=True):
+        """
+        make sure edit memory holds waveform `key`, calling
+        `make_data()` for the waveform if it has to be uploaded.
+        Uploads are kept in a spare register, if `keep` is True.
+        """
+        if self.contents.get('emem') == key:
+            return
+        for register in self.spare:
+            if self.contents.get(register) == key:
+                self.arb.copy_from(register)
+                self.contents['emem'] = key
+                self._touch(register)
+                return
+        data = make_data()
+        self.arb.npts = len(data)
+        self.arb.set_data(data)
+        self.contents['emem'] = key
+        if keep and self.spare:
+            register = self.spare[0]
+            self.arb.copy_to(register)
+            self.contents[register] = key
+            self._touch(register)
+
+    def place(self, key, make_data, avoid=()):
+        """
+        make sure some spare user register (other than those in
+        `avoid`) holds waveform `key`, and return its name. Edit
+        memory is used as scratch space for the upload.
+        """
+        for register in self.spare:
+            if register not in avoid and self.contents.get(register) == key:
+                self._touch(register)
+                return register
+        register = [r for r in self.spare if r not in avoid][0]
+        self.store(key, make_data, register)
+        self._touch(register)
+        return register
+
+    def store(self, key, make_data, register):
+        """ make sure `register` holds waveform `key` """
+        if self.contents.get(register) == key:
+            return
+        self.load(key, make_data, keep=False)
+        self.arb.copy_to(register)
+        self.contents[register] = key
+
+    def forget(self, register='emem'):
+        """ the instrument's copy of `register` was changed elsewhere """
+        self.contents.pop(register, None)
+
+# one ArbMemory per instrument, for the life of the program
+memories = {}
+
+def arb_memory(bus, reserved=()):
+    try:
+        return memories[bus]
+    except KeyError:
+        memories[bus] = ArbMemory(Arb(bus), reserved)
+        return memories[bus]
 
-    npts = len(s)     # number of waveform points
-    naqs = npts // 2  # number of acquisitions (pixels)
+# load it
 
-    # load into the two AFGs
-    det_arb.npts = npts
-    det_arb.set_data(s)
-    det_arb.copy_to('user3') # ch1 : user3
-    det_arb.set_data(Y)      # ch2 : emem
-    rf_arb.npts = npts
-    rf_arb.set_data(X)
+class UploadError(Exception):
+    """
+    Configuring one or more AFGs failed. `errors` holds an
+    (instrument, exception) pair for each failure.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        msg = '; '.join('%s: %r' % (bus, e) for bus, e in errors)
+        Exception.__init__(self, msg)
 
-    # configure AFGs
-    s_ch.set_mode('user3')
-    y_ch.set_mode('emem')
-    x_ch.set_mode('emem')
+# one lock per instrument, so only one thread talks to it at a time
+locks = {}
+_locks_lock = threading.Lock()
 
-    total_time = naqs * t
-    for ch in (x_ch, y_ch, s_ch):
-        ch.freq = 1. / total_time
+def bus_lock(bus):
+    with _locks_lock:
+        return locks.setdefault(bus, threading.Lock())
+
+def run_concurrently(*jobs):
+    """
+    run each (bus, func) pair in a thread of its own, holding the
+    lock for that bus. Waits for all of them, then raises an
+    UploadError listing whichever failed.
+    """
+    errors = []
+    def run(bus, func):
+        try:
+            with bus_lock(bus):
+                func()
+        except Exception as e:
+            errors.append((bus, e))
+    threads = [threading.Thread(target=run, args=job) for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise UploadError(errors)
+
+def make_and_load_waveforms(X, Y, t, det_afg, rf_afg, zigzag=False):
+    det_mem = arb_memory(det_afg, reserved=('user3',))
+    rf_mem = arb_memory(rf_afg)
+
+    s_ch = AFG_channel(det_afg, 1)
+    y_ch = AFG_channel(det_afg, 2)
+    x_ch = AFG_channel(rf_afg)
+
+    npts = 2 * len(X) * len(Y)  # number of waveform points
+    naqs = npts // 2            # number of acquisitions (pixels)
+    freq = 1. / (naqs * t)
+
+    waves = []
+    waves_lock = threading.Lock()
+    def wave(i):
+        # only compute the waveforms if something needs uploading
+        with waves_lock:
+            if not waves:
+                waves.extend(make_waveforms(X, Y, zigzag))
+        return waves[i]
+
+    key = grid_key(X, Y, zigzag)
+
+    # the two AFGs don't depend on each other, so
+    # load and configure them at the same time
+    def load_det():
+        with batched(det_afg):
+            det_mem.store(('sync', npts), lambda: wave(2), 'user3')
+            det_mem.load(('y', key), lambda: wave(1))
+            s_ch.set_mode('user3')  # ch1 : user3
+            y_ch.set_mode('emem')   # ch2 : emem
+            y_ch.freq = freq
+            s_ch.freq = freq
+
+    def load_rf():
+        with batched(rf_afg):
+            rf_mem.load(('x', key), lambda: wave(0))
+            x_ch.set_mode('emem')
+            x_ch.freq = freq
+
+    run_concurrently((det_afg, load_det), (rf_afg, load_rf))
 
     return naqs
 
@@ -72,34 +226,16 @@ class AFGasDAC(object):
         return self.arb.get_point(1)
 
     def set_value(self, value):
-        return self.arb.set_point(1, value)
+        with bus_lock(self.arb.bus):
+            # edit memory no longer holds whatever grid was loaded
+            mem = memories.get(self.arb.bus)
+            if mem is not None:
+                mem.forget('emem')
+            return self.arb.set_point(1, value)
 
 
 from PyDAQmx import *
-from .expt import make_pulse
-
-def make_buffered_counter(samps, countchan, sampleclk, trig=None):
-    ctr = Task()
-    ctr.CreateCICountEdgesChan(countchan, "",
-                               DAQmx_Val_Rising,
-                               0,  # initial count
-                               DAQmx_Val_CountUp)
-
-    # configure sample clock (http://www.ni.com/white-paper/5404/en/)
-    ctr.CfgSampClkTiming(sampleclk,   # source of the sample clock
-                         10000,  # rate of the sample clock.
-                                 # not sure about units, lifted from white paper
-                         DAQmx_Val_Rising,       # activeEdge
-                         DAQmx_Val_FiniteSamps,  # sampleMode
-                         samps)                    # sampsPerChanToAcquire
-
-    if trig is not None:
-        # configure pause trigger
-        ctr.SetPauseTrigType(DAQmx_Val_DigLvl)
-        ctr.SetDigLvlPauseTrigSrc(trig)
-        ctr.SetDigLvlPauseTrigWhen(DAQmx_Val_Low)
-
-    return ctr
+from .expt import make_pulse, make_buffered_counter, read_counts
 
 def many_samples(samps, timeout, pulsechan, countchan, sampleclk, trig=None):
     ctr = make_buffered_counter(samps, countchan=countchan,
@@ -111,7 +247,7 @@ def many_samples(samps, timeout, pulsechan, countchan, sampleclk, trig=None):
     co.StartTask()   # send trigger
     # while that's going, allocate some memory
     spcr = c_long()
-    data = n.zeros((samps,), dtype=numpy.uint32)
+    data = n.zeros((samps,), dtype=n.uint32)
     ctr.WaitUntilTaskDone(timeout)
     # now read out the data
     ctr.ReadCounterU32(samps, # number of samples to read
@@ -126,12 +262,99 @@ def many_samples(samps, timeout, pulsechan, countchan, sampleclk, trig=None):
     assert spcr.value == samps
     return data
 
+def stream_samples(data, chunk, timeout, pulsechan, countchan, sampleclk,
+                   trig=None):
+    """
+    like many_samples, but fills the uint32 array `data` `chunk`
+    samples at a time as they come in, yielding the number of samples
+    read so far after each chunk.
+    """
+    samps = data.size
+    ctr = make_buffered_counter(samps, countchan=countchan,
+                                       sampleclk=sampleclk,
+                                       trig=trig)
+    # make a pulse to trigger the burst on AFGs
+    co = make_pulse(.01, pulsechan=pulsechan)
+    ctr.StartTask()  # start counting
+    co.StartTask()   # send trigger
+    try:
+        for start in xrange(0, samps, chunk):
+            stop = min(start + chunk, samps)
+            read_counts(ctr, data[start:stop], timeout)
+            yield stop
+    finally:
+        ctr.ClearTask()
+        co.ClearTask()
+
+def start_samples(samps, pulsechan, countchan, sampleclk, trig=None):
+    """
+    start a buffered acquisition of `samps` samples, as in
+    many_samples, returning the (counter, pulse) tasks so the caller
+    can do something else before reading them out.
+    """
+    ctr = make_buffered_counter(samps, countchan=countchan,
+                                       sampleclk=sampleclk,
+                                       trig=trig)
+    # make a pulse to trigger the burst on AFGs
+    co = make_pulse(.01, pulsechan=pulsechan)
+    ctr.StartTask()  # start counting
+    co.StartTask()   # send trigger
+    return ctr, co
+
+class FrameDecoder(object):
+    """
+    Turns cumulative buffered counter data into images of counts per
+    pixel, without allocating anything per frame.
+
+    Differences are taken in uint32, so they come out right even if
+    the counter wraps around mid-frame. Zigzag rows are put back in
+    order through an index map worked out once, here. `last` is the
+    count the next frame continues from; it is kept up to date as
+    frames are decoded, for counters that run across frames.
+    """
+
+    def __init__(self, shape, zigzag=False):
+        ny, nx = shape
+        self.shape = shape
+        self.counts = n.zeros(ny * nx, dtype=n.uint32)
+        if zigzag:
+            order = n.arange(ny * nx).reshape(shape)
+            order[1::2] = order[1::2, ::-1]
+            self.order = order.ravel()
+            self.image = n.zeros(shape, dtype=n.uint32)
+        else:
+            self.order = None
+            self.image = self.counts.reshape(shape)
+        self.last = n.zeros(1, dtype=n.uint32)
+
+    def decode(self, result, start=0, stop=None, prev=None):
+        """
+        decode rows `start` through `stop` of the frame from `result`,
+        the cumulative counts for the whole frame, into `self.image`.
+        `prev` is the count the frame started from (by default, the
+        last count of the frame decoded before it). Returns the
+        decoded rows, which are overwritten by the next call.
+        """
+        ny, nx = self.shape
+        if stop is None:
+            stop = ny
+        if prev is not None:
+            self.last[0] = prev
+        a, b = start * nx, stop * nx
+        if b <= a:
+            return self.image[start:stop]
+        counts = self.counts
+        before = result[a-1:a] if a else self.last
+        n.subtract(result[a:a+1], before, out=counts[a:a+1])
+        n.subtract(result[a+1:b], result[a:b-1], out=counts[a+1:b])
+        if self.order is not None:
+            n.take(counts, self.order[a:b], out=self.image.reshape(-1)[a:b])
+        if stop == ny:
+            self.last[0] = result[b-1]
+        return self.image[start:stop]
+
 def decode_image(result, shape, zigzag=False):
-    im = n.diff(n.insert(result,0,0))
-    im = im.reshape(*shape)
-    if zigzag:
-        im[1::2] = im[1::2][:,::-1]  #zigzag
-    return im
+    return FrameDecoder(shape, zigzag).decode(result).copy()
 
 # generators for the GUI
 
@@ -140,9 +363,17 @@ def generate_frames(X, Y, t=.01, repeat=True,
                     countchan="Dev1/ctr0",
                     sampleclk="PFI34",
                     det_afg=None, rf_afg=None):
+    """
+    scan the grid (X, Y) as a burst of the AFG waveforms, yielding
+    (frame, rows) after each frame, where `rows` is a slice of the
+    lines of `frame` that are new since the last yield. The other
+    generators below yield the same way.
+    """
     naqs = make_and_load_waveforms(X, Y, t, det_afg, rf_afg)
     outshape = Y.shape + X.shape
     timeout = 5. + naqs * t
+    decoder = FrameDecoder(outshape)
+    frame = n.zeros(outshape)
     while True:
         try:
             result = many_samples(naqs, timeout,
@@ -152,35 +383,420 @@ def generate_frames(X, Y, t=.01, repeat=True,
         except DAQError as e:
             print(e)
             raise StopIteration
-        yield decode_image(result, shape=outshape)/t
+        n.divide(decoder.decode(result, prev=0), t, out=frame)
+        yield frame, slice(None)
         if not repeat:
             break
 
-def update_result(gen, resultarray):
+def stream_frames(X, Y, t=.01, repeat=True,
+                  pulsechan="Dev1/ctr2",
+                  countchan="Dev1/ctr0",
+                  sampleclk="PFI34",
+                  det_afg=None, rf_afg=None,
+                  chunk_time=.1):
     """
-    plays the same role as yielding_fromiter,
-    but expects gen to yield the whole result each time
+    like generate_frames, but reads out the counter every
+    `chunk_time` seconds or so while a frame is in progress, and
+    yields the frame each time with the completed lines filled in.
+    """
+    naqs = make_and_load_waveforms(X, Y, t, det_afg, rf_afg)
+    outshape = Y.shape + X.shape
+    nx = len(X)
+    chunk = nx * max(1, int(chunk_time / (nx * t)))
+    timeout = 5. + chunk * t
+    data = n.zeros((naqs,), dtype=n.uint32)
+    decoder = FrameDecoder(outshape)
+    frame = n.zeros(outshape)
+    while True:
+        done = 0
+        try:
+            for nread in stream_samples(data, chunk, timeout,
+                                        pulsechan=pulsechan,
+                                        countchan=countchan,
+                                        sampleclk=sampleclk):
+                ready = nread // nx
+                rows = decoder.decode(data, done, ready, prev=0)
+                n.divide(rows, t, out=frame[done:ready])
+                yield frame, slice(done, ready)
+                done = ready
+        except DAQError as e:
+            print(e)
+            raise StopIteration
+        if not repeat:
+            break
 
+def plan_tiles(X, Y, maxpts=None):
+    """
+    split the grid (X, Y) into bands of whole lines that each fit in
+    AFG memory. Returns a list of Y arrays, one per band, all the same
+    length so they can share one sync waveform; the last band is
+    padded out by repeating its last line.
+    """
+    if maxpts is None:
+        maxpts = MAXPTS
+    rows = maxpts // (2 * len(X))
+    if rows < 1:
+        raise ValueError("a line of %d points does not fit in AFG memory"
+                         % len(X))
+    ntiles = -(-len(Y) // rows)  # round up
+    rows = -(-len(Y) // ntiles)  # and even them out
+    bands = []
+    for i in range(ntiles):
+        band = Y[i * rows:(i + 1) * rows]
+        pad = n.repeat(band[-1:], rows - len(band))
+        bands.append(n.concatenate((band, pad)))
+    return bands
+
+def tiled_frames(X, Y, t=.01, repeat=True,
+                 pulsechan="Dev1/ctr2",
+                 countchan="Dev1/ctr0",
+                 sampleclk="PFI34",
+                 det_afg=None, rf_afg=None):
     """
-    for result in gen:
-        resultarray[:] = result
-        yield
+    like generate_frames, for grids too big for AFG memory.
+
+    The grid is scanned in bands of lines (see plan_tiles). X and the
+    sync waveform are the same for every band, so only Y changes:
+    each band's Y plays from a spare user register of det_afg, and the
+    next band's Y is uploaded into another one while the current band
+    is being scanned. The frame is yielded after each band.
+    """
+    bands = plan_tiles(X, Y)
+    rows = len(bands[0])
+    ny = len(Y)
+    naqs = make_and_load_waveforms(X, bands[0], t, det_afg, rf_afg)
+    det_mem = arb_memory(det_afg)
+    y_ch = AFG_channel(det_afg, 2)
+    timeout = 5. + naqs * t
+
+    def place(k, avoid=()):
+        band = bands[k]
+        with bus_lock(det_afg):
+            return det_mem.place(('y', grid_key(X, band)),
+                                 lambda: make_waveforms(X, band)[1],
+                                 avoid)
+
+    data = n.zeros((naqs,), dtype=n.uint32)
+    decoder = FrameDecoder((rows, len(X)))
+    frame = n.zeros(Y.shape + X.shape)
+    register = place(0)
+    while True:
+        for k in range(len(bands)):
+            with bus_lock(det_afg):
+                y_ch.set_mode(register)
+            try:
+                ctr, co = start_samples(naqs, pulsechan=pulsechan,
+                                        countchan=countchan,
+                                        sampleclk=sampleclk)
+                try:
+                    # get the next band ready while this one scans
+                    following = k + 1 if k + 1 < len(bands) else 0
+                    if following or repeat:
+                        register = place(following, avoid=(register,))
+                    read_counts(ctr, data, timeout)
+                finally:
+                    ctr.ClearTask()
+                    co.ClearTask()
+            except DAQError as e:
+                print(e)
+                raise StopIteration
+            tile = decoder.decode(data, prev=0)
+            start, stop = k * rows, min((k + 1) * rows, ny)
+            n.divide(tile[:stop - start], t, out=frame[start:stop])
+            yield frame, slice(start, stop)
+        if not repeat:
+            break
+
+class FrameRing(object):
+    """
+    A ring of `nslots` preallocated frames of raw counter data.
+
+    One thread fills the next slot and commits it; readers always get
+    the newest complete frame, skipping any they were too slow for.
+    A committed frame stays intact until nslots-1 more have come in,
+    so readers have that long to decode it.
+    """
+
+    def __init__(self, nslots, naqs):
+        self.frames = n.zeros((nslots, naqs), dtype=n.uint32)
+        self.count = 0  # number of frames committed
+        self.cond = threading.Condition()
+
+    def next_slot(self):
+        """ the slot to be filled next """
+        return self.frames[self.count % len(self.frames)]
+
+    def commit(self):
+        """ mark the slot from next_slot() as complete """
+        with self.cond:
+            self.count += 1
+            self.cond.notify_all()
+
+    def wait(self, seen, timeout=None):
+        """
+        wait for a frame newer than frame number `seen`. Returns the
+        number of the newest frame, or `seen` again on timeout.
+        """
+        with self.cond:
+            if self.count <= seen:
+                self.cond.wait(timeout)
+            return self.count
+
+    def get(self, count):
+        """
+        frame number `count`, along with the last count of the frame
+        before it (which this one continues from)
+        """
+        nslots = len(self.frames)
+        prev = self.frames[(count - 2) % nslots][-1] if count > 1 else 0
+        return self.frames[(count - 1) % nslots], prev
+
+class FrameAcquirer(threading.Thread):
+    """
+    Keeps one counter task running across frames, retriggering the
+    AFG burst as soon as each frame is in, and puts the frames into
+    the FrameRing `ring`.
+    """
+
+    def __init__(self, ring, timeout, pulsechan, countchan, sampleclk):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.ring = ring
+        self.timeout = timeout
+        self.pulsechan = pulsechan
+        self.countchan = countchan
+        self.sampleclk = sampleclk
+        self.error = None
+        self._want_abort = 0
+
+    def run(self):
+        naqs = self.ring.frames.shape[-1]
+        ctr = make_buffered_counter(4 * naqs, countchan=self.countchan,
+                                    sampleclk=self.sampleclk,
+                                    continuous=True)
+        # make a pulse to trigger the burst on AFGs
+        co = make_pulse(.01, pulsechan=self.pulsechan)
+        try:
+            ctr.StartTask()  # start counting, and keep at it
+            while not self._want_abort:
+                co.StartTask()   # send trigger
+                read_counts(ctr, self.ring.next_slot(), self.timeout)
+                co.StopTask()
+                self.ring.commit()
+        except DAQError as e:
+            self.error = e
+        finally:
+            ctr.ClearTask()
+            co.ClearTask()
+
+    def abort(self):
+        self._want_abort = 1
+
+def continuous_frames(X, Y, t=.01, nslots=3,
+                      pulsechan="Dev1/ctr2",
+                      countchan="Dev1/ctr0",
+                      sampleclk="PFI34",
+                      det_afg=None, rf_afg=None):
+    """
+    like generate_frames with repeat=True, but the counter runs
+    continuously in the background (see FrameAcquirer), so there is
+    no task setup between frames. Yields the newest complete frame
+    each time; frames that come in faster than they are consumed are
+    skipped.
+    """
+    naqs = make_and_load_waveforms(X, Y, t, det_afg, rf_afg)
+    outshape = Y.shape + X.shape
+    ring = FrameRing(nslots, naqs)
+    acq = FrameAcquirer(ring, 5. + naqs * t,
+                        pulsechan=pulsechan,
+                        countchan=countchan,
+                        sampleclk=sampleclk)
+    decoder = FrameDecoder(outshape)
+    frame = n.zeros(outshape)
+    seen = 0
+    acq.start()
+    try:
+        while acq.is_alive():
+            count = ring.wait(seen, timeout=.1)
+            if count == seen:
+                continue
+            seen = count
+            result, prev = ring.get(count)
+            n.divide(decoder.decode(result, prev=prev), t, out=frame)
+            yield frame, slice(None)
+        if acq.error is not None:
+            print(acq.error)
+    finally:
+        acq.abort()
+        acq.join()
+
+class FrameAccumulator(object):
+    """
+    Combines the frames of a repeated scan, to trade update speed for
+    signal-to-noise without lengthening the dwell time.
+
+    mode is one of
+        'none': show each frame as it comes
+        'sum': the running sum of every frame so far, shown as the
+            mean (so the units stay counts per second)
+        'ema': an exponential moving average, weighting each new
+            frame by `alpha`
+        'boxcar': the mean of the last `navg` frames
+
+    Frames are taken a block of lines at a time, and each line keeps
+    its own count of the frames in it, so frames that are delivered
+    progressively are still counted once. All buffers are allocated
+    once per scan grid; the accumulator resets itself when start() is
+    called with a different grid than the one before.
+    """
+
+    MODES = ('none', 'sum', 'ema', 'boxcar')
+
+    def __init__(self, mode='none', alpha=.1, navg=8):
+        if mode not in self.MODES:
+            raise ValueError("unknown accumulation mode %r" % mode)
+        self.mode = mode
+        self.alpha = alpha
+        self.navg = navg
+        self.key = None
+        self.shape = None
+
+    def start(self, X, Y):
+        """ get ready for a scan of (X, Y), resetting if it's new """
+        key = grid_key(X, Y)
+        if key != self.key:
+            self.key = key
+            self.reset(Y.shape + X.shape)
+
+    def reset(self, shape=None):
+        """ forget all frames, and reallocate for `shape` if given """
+        if shape is not None and shape != self.shape:
+            self.shape = shape
+            ny, nx = shape
+            self.nframes = n.zeros((ny,), dtype=n.uint32)
+            self.total = n.zeros(shape, dtype=n.float32)
+            self.scratch = n.zeros(shape, dtype=n.float32)
+            if self.mode == 'boxcar':
+                self.ring = n.zeros((self.navg,) + shape, dtype=n.float32)
+        self.nframes[:] = 0
+        self.total[:] = 0
+        if self.mode == 'boxcar':
+            self.ring[:] = 0
+
+    def add(self, frame, rows, out):
+        """
+        accumulate lines `rows` (a slice) of `frame`, and put the
+        result for those lines into the same lines of `out`
+        """
+        if self.mode == 'none':
+            out[rows] = frame[rows]
+            return
+        start, stop, _ = rows.indices(len(frame))
+        if stop <= start:
+            return
+        new = frame[start:stop]
+        total = self.total[start:stop]
+        count = self.nframes[start:stop]
+        depth = self.scratch[start:stop, :1]  # frames per line, as float
+        if self.mode == 'sum':
+            total += new
+            count += 1
+            depth[:, 0] = count
+        elif self.mode == 'ema':
+            fresh = count == 0
+            diff = self.scratch[start:stop]
+            n.subtract(new, total, out=diff)
+            diff *= self.alpha
+            total += diff
+            total[fresh] = new[fresh]
+            count += 1
+            depth[:] = 1
+        elif self.mode == 'boxcar':
+            lines = n.arange(start, stop)
+            slots = count % self.navg
+            total -= self.ring[slots, lines]
+            self.ring[slots, lines] = new
+            total += new
+            count += 1
+            # rebuild the totals once per trip round the ring, so
+            # rounding errors don't pile up
+            wrapped = lines[slots == self.navg - 1]
+            if len(wrapped):
+                self.total[wrapped] = self.ring[:, wrapped].sum(axis=0)
+            n.minimum(count, self.navg, out=depth[:, 0], casting='unsafe')
+        n.divide(total, depth, out=out[start:stop])
+
+    def saved(self):
+        """ arrays describing the accumulation, for saving with the image """
+        return dict(accumulate=self.mode,
+                    nframes=self.nframes if self.shape else 0,
+                    alpha=self.alpha,
+                    navg=self.navg)
+
+def update_result(gen, resultarray, accumulator=None):
+    """
+    plays the same role as slow.yielding_lines,
+    but expects gen to yield (frame, rows) as the frame generators
+    above do. New lines go through `accumulator`, if given.
+
+    """
+    try:
+        for result, rows in gen:
+            if accumulator is None:
+                resultarray[rows] = result[rows]
+            else:
+                accumulator.add(result, rows, resultarray)
+            yield
+    finally:
+        gen.close()
 
 def make_generator_factory(xgalvo, ygalvo,
                            pulsechan, countchan, sampleclk,
-                           det_afg, rf_afg):
+                           det_afg, rf_afg, chunk_time=.1,
+                           continuous=True, accumulator=None):
     # don't do anything with the galvos, they're fake
 
     def make_data_generator(X, Y, t, vector, repeat=True):
-        gen = generate_frames(X, Y, t, repeat=repeat,
-                              pulsechan=pulsechan,
-                              countchan=countchan,
-                              sampleclk=sampleclk,
-                              det_afg=det_afg,
-                              rf_afg=rf_afg,
-                              )
-        return update_result(gen, vector)
-
+        if 2 * len(X) * len(Y) > MAXPTS:
+            gen = tiled_frames(X, Y, t, repeat=repeat,
+                               pulsechan=pulsechan,
+                               countchan=countchan,
+                               sampleclk=sampleclk,
+                               det_afg=det_afg,
+                               rf_afg=rf_afg,
+                               )
+        elif repeat and continuous:
+            gen = continuous_frames(X, Y, t,
+                                    pulsechan=pulsechan,
+                                    countchan=countchan,
+                                    sampleclk=sampleclk,
+                                    det_afg=det_afg,
+                                    rf_afg=rf_afg,
+                                    )
+        elif chunk_time is None:
+            gen = generate_frames(X, Y, t, repeat=repeat,
+                                  pulsechan=pulsechan,
+                                  countchan=countchan,
+                                  sampleclk=sampleclk,
+                                  det_afg=det_afg,
+                                  rf_afg=rf_afg,
+                                  )
+        else:
+            gen = stream_frames(X, Y, t, repeat=repeat,
+                                pulsechan=pulsechan,
+                                countchan=countchan,
+                                sampleclk=sampleclk,
+                                det_afg=det_afg,
+                                rf_afg=rf_afg,
+                                chunk_time=chunk_time,
+                                )
+        if accumulator is not None:
+            accumulator.start(X, Y)
+        return update_result(gen, vector, accumulator)
+
+    # so the GUI can save what has been accumulated
+    if accumulator is not None:
+        make_data_generator.saved = accumulator.saved
     return make_data_generator
 
 def main():
@@ -200,13 +816,22 @@ def main():
     det_afg = rm.get_instrument(cfg.get('fast', 'det_afg'), timeout=10e3)
     rf_afg = rm.get_instrument(cfg.get('fast', 'rf_afg'), timeout=10e3)
 
+    # batch commands, and skip the ones that change nothing
+    det_afg = SCPIBus(det_afg)
+    rf_afg = SCPIBus(rf_afg)
+
     ygalvo = AFGasDAC(det_afg)
     xgalvo = AFGasDAC(rf_afg)
 
+    accumulator = FrameAccumulator(cfg.get('fast', 'accumulate'),
+                                   alpha=cfg.getfloat('fast', 'alpha'),
+                                   navg=cfg.getint('fast', 'navg'))
+
     make_data_generator = make_generator_factory(xgalvo, ygalvo,
                                                  pulsechan, countchan,
                                                  sampleclk,
-                                                 det_afg, rf_afg)
+                                                 det_afg, rf_afg,
+                                                 accumulator=accumulator)
 
     # gui app
     app = wx.App(False)
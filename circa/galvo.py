@@ -1,8 +1,71 @@
 from __future__ import division
 
+import sys
+import threading
 import wx
 from wx.lib import intctrl, newevent
 
+class GalvoWriter(threading.Thread):
+    """
+    Moves the galvos from a background thread, so that a slow DAC or
+    bus never blocks the GUI.
+
+    Only the most recently requested position for each axis is kept:
+    requests that arrive while a move is in progress replace each
+    other, and the newest is sent as soon as the hardware is free.
+    After each move, `callback(axis, value)` is called from the
+    writer thread with the position actually applied.
+    """
+
+    def __init__(self, xgalvo, ygalvo, callback=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.galvos = {'x': xgalvo, 'y': ygalvo}
+        self.callback = callback
+        self.pending = {}
+        self.cond = threading.Condition()
+        self._want_abort = 0
+
+    def request(self, axis, value):
+        """ ask for `axis` ('x' or 'y') to be moved to `value` """
+        with self.cond:
+            self.pending[axis] = value
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not (self.pending or self._want_abort):
+                    self.cond.wait()
+                if self._want_abort:
+                    return
+                pending, self.pending = self.pending, {}
+            try:
+                self.apply(pending)
+            except Exception as e:
+                sys.stderr.write('could not move galvos: %s\n' % e)
+
+    def apply(self, pending):
+        xgalvo, ygalvo = self.galvos['x'], self.galvos['y']
+        pair = getattr(xgalvo, 'pair', None)
+        if (len(pending) == 2 and pair is not None
+                and pair is getattr(ygalvo, 'pair', None)):
+            # both move in one write
+            pair.set_values(pending['x'], pending['y'])
+        else:
+            for axis, value in sorted(pending.items()):
+                self.galvos[axis].set_value(value)
+        if self.callback is not None:
+            for axis, value in sorted(pending.items()):
+                self.callback(axis, value)
+
+    def abort(self):
+        """ stop the writer thread, dropping any pending moves """
+        with self.cond:
+            self._want_abort = 1
+            self.cond.notify()
+
+
 class GalvoWindow(wx.Frame):
 
     def __init__(self, parent, title, xcall=None, ycall=None):
@@ -12,6 +12,7 @@ from time import sleep, time
 import threading
 from collections import deque
 from .util import get_next_filename
+from .record import MonitorRecorder
 
 class ScrollingLocator(mticker.MaxNLocator):
 
@@ -20,6 +21,202 @@ class ScrollingLocator(mticker.MaxNLocator):
         return mtransforms.nonsingular(vmin, vmax)
 
 
+class RingBuffer(object):
+    """
+    An array of the most recent `maxlen` samples, or of all of them if
+    maxlen is None.
+
+    Every sample is stored twice, half the storage apart, so that the
+    samples in order are always one contiguous slice: view() returns
+    them without copying. Appending a sample or a block of them costs
+    the same however many are stored. Without a maxlen, the storage
+    doubles whenever it fills up.
+    """
+
+    def __init__(self, maxlen=None, dtype=float, size=1024):
+        self.maxlen = maxlen
+        self.data = n.zeros((2 * (maxlen or size),), dtype=dtype)
+        self.head = 0  # where the next sample goes
+        self.count = 0
+        self.total = 0  # samples ever appended
+
+    @property
+    def capacity(self):
+        return len(self.data) // 2
+
+    def __len__(self):
+        return self.count
+
+    def view(self):
+        """ the stored samples, oldest first (not a copy) """
+        start = (self.head - self.count) % self.capacity
+        return self.data[start:start + self.count]
+
+    def append(self, value):
+        cap = self.capacity
+        if self.maxlen is None and self.count == cap:
+            self._reallocate(2 * cap)
+            cap = self.capacity
+        self.data[self.head] = self.data[self.head + cap] = value
+        self.head = (self.head + 1) % cap
+        self.count = min(self.count + 1, cap)
+        self.total += 1
+
+    def extend(self, values):
+        values = n.asarray(values)
+        cap = self.capacity
+        if self.maxlen is None and self.count + len(values) > cap:
+            self._reallocate(max(2 * cap, self.count + len(values)))
+            cap = self.capacity
+        self.total += len(values)
+        values = values[-cap:]
+        k = len(values)
+        first = min(k, cap - self.head)
+        for offset in (0, cap):
+            start = offset + self.head
+            self.data[start:start + first] = values[:first]
+            self.data[offset:offset + k - first] = values[first:]
+        self.head = (self.head + k) % cap
+        self.count = min(self.count + k, cap)
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+        self.total = 0
+
+    def resize(self, maxlen):
+        """ change maxlen, keeping the most recent samples """
+        self.maxlen = maxlen
+        self._reallocate(maxlen or max(2 * self.count, 1024))
+
+    def _reallocate(self, cap):
+        keep = self.view()[-cap:]
+        data = n.zeros((2 * cap,), dtype=self.data.dtype)
+        data[:len(keep)] = keep
+        data[cap:cap + len(keep)] = keep
+        self.data = data
+        self.count = len(keep)
+        self.head = self.count % cap
+
+
+class MinMaxLevels(object):
+    """
+    Min/max summaries of the samples in the RingBuffers `x` and `y`,
+    for plotting long histories quickly.
+
+    Level k holds, for each bucket of 2**k consecutive samples, the
+    x of its first sample and the least and greatest y. Each level is
+    built from the one below, a pair of buckets at a time, and only
+    for samples that have come in since the last update(), so the
+    summaries are never worked out from scratch unless the buffers
+    are resized. Levels are added while they still have more than
+    `minlen` buckets. x is assumed not to decrease.
+    """
+
+    def __init__(self, x, y, minlen=256):
+        self.x = x
+        self.y = y
+        self.minlen = minlen
+        self.reset()
+
+    def reset(self):
+        """ forget the summaries, to be rebuilt by the next update() """
+        self.levels = []
+        self.totals = [] # buckets ever added, per level
+
+    def _new_level(self):
+        k = len(self.levels) + 1
+        maxlen = self.x.maxlen
+        if maxlen is not None:
+            maxlen = maxlen // 2**k + 2
+        self.levels.append((RingBuffer(maxlen), RingBuffer(maxlen),
+                            RingBuffer(maxlen)))
+        self.totals.append(0)
+
+    def _level(self, k):
+        """ (total, x, lo, hi) for level k; level 0 is the samples """
+        if k == 0:
+            y = self.y.view()
+            return self.x.total, self.x.view(), y, y
+        x, lo, hi = self.levels[k - 1]
+        return self.totals[k - 1], x.view(), lo.view(), hi.view()
+
+    def update(self):
+        """ summarize whatever has come in since the last update """
+        k = 1
+        while True:
+            total, x, lo, hi = self._level(k - 1)
+            if k > len(self.levels):
+                if len(x) <= 2 * self.minlen:
+                    break
+                self._new_level()
+            # buckets the level below has all of since this one was
+            # last updated. samples that were dropped before they
+            # could be summarized are skipped
+            start = total - len(x)
+            first = max(self.totals[k - 1], -(-start // 2))
+            last = total // 2
+            if last > first:
+                a, b = 2 * first - start, 2 * last - start
+                xs, los, his = self.levels[k - 1]
+                xs.extend(x[a:b:2])
+                los.extend(lo[a:b].reshape(-1, 2).min(axis=1))
+                his.extend(hi[a:b].reshape(-1, 2).max(axis=1))
+                self.totals[k - 1] = last
+            k += 1
+
+    def _leftovers(self, k):
+        """
+        (x, lo, hi) for the samples that are not in a complete bucket
+        of level k yet: at most a bucket from each level below it,
+        newest last
+        """
+        pieces = []
+        for j in range(k - 1, -1, -1):
+            total, x, lo, hi = self._level(j)
+            start = max(2 * self.totals[j] - (total - len(x)), 0)
+            pieces.append((x[start:], lo[start:], hi[start:]))
+        return pieces
+
+    def bounds(self):
+        """ (xmin, xmax, ymin, ymax) of all the samples """
+        k = len(self.levels)
+        total, x, lo, hi = self._level(k)
+        pieces = [(x, lo, hi)] + self._leftovers(k)
+        pieces = [piece for piece in pieces if len(piece[0])]
+        x = self.x.view()
+        return (x[0], x[-1],
+                min(lo.min() for x, lo, hi in pieces),
+                max(hi.max() for x, lo, hi in pieces))
+
+    def decimate(self, xlim, width):
+        """
+        (x, y) to plot the samples between xlim, at about two points
+        per pixel across `width` pixels. Where there are more samples
+        than that, each bucket is drawn as a vertical line from its
+        least to its greatest y.
+        """
+        for k in range(len(self.levels) + 1):
+            total, x, lo, hi = self._level(k)
+            i0, i1 = n.searchsorted(x, xlim)
+            if i1 - i0 <= (2 * width if k == 0 else width):
+                break
+        at_end = i1 >= len(x)
+        # one more on each side, so the line runs off the edges
+        i0, i1 = max(i0 - 1, 0), i1 + 1
+        if k == 0:
+            return x[i0:i1], lo[i0:i1]
+        pieces = [(x[i0:i1], lo[i0:i1], hi[i0:i1])]
+        if at_end:
+            pieces += self._leftovers(k)
+        x, lo, hi = [n.concatenate(a) for a in zip(*pieces)]
+        xy = n.empty((2, 2 * len(x)))
+        xy[0, 0::2] = xy[0, 1::2] = x
+        xy[1, 0::2] = lo
+        xy[1, 1::2] = hi
+        return xy[0], xy[1]
+
+
 def silly_gen(inc=0.1):
     """
     a silly generator function producing 'data'
@@ -44,30 +241,105 @@ ResultEvent, EVT_RESULT = wx.lib.newevent.NewEvent()
 # for scan being finished
 FinishedEvent, EVT_FINISHED = wx.lib.newevent.NewEvent()
 
+# for telling the GUI there are batched results to collect
+WakeupEvent, EVT_WAKEUP = wx.lib.newevent.NewEvent()
+
 # Thread class that executes processing
 class WorkerThread(threading.Thread):
-    """Worker Thread Class."""
-    def __init__(self, notify_window, gen):
+    """
+    Worker Thread Class.
+
+    Each result from `gen` reaches `notify_window` as a ResultEvent,
+    with the result as its `data`, and a list of results as `items`.
+
+    If `batched` is True, results are queued rather than posted one by
+    one, and the GUI is sent a single wakeup whenever the queue goes
+    from empty to not. The wakeup collects everything queued by then
+    and delivers it as one ResultEvent, with all of it in `items` and
+    the newest in `data`. At most `maxsize` results are kept waiting
+    (0 for no limit); past that the oldest are dropped. `depth` and
+    `dropped` say how many are waiting and how many have been dropped.
+
+    If `close` is True, the worker owns `gen`, and closes it when the
+    thread stops, finished or aborted. Leave it False for a generator
+    that will be handed to another worker later.
+    """
+    def __init__(self, notify_window, gen, batched=True, maxsize=0,
+                 close=False):
         """Init Worker Thread Class."""
         threading.Thread.__init__(self)
         self.gen = gen
+        self.close_gen = close
         self._notify_window = notify_window
         self._want_abort = 0
+        self.batched = batched
+        self.pending = deque(maxlen=maxsize or None)
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self._awake = False  # a wakeup is on its way
+        if batched:
+            notify_window.Bind(EVT_WAKEUP, self.on_wakeup)
+
+    @property
+    def depth(self):
+        return len(self.pending)
 
     def run(self):
         """Run Worker Thread."""
         # This is the code executing in the new thread.
         start = time()
-        # peek at the abort variable once in a while to see if we should stop
-        for data in self.gen:
-            if self._want_abort:
-                break
-            # Send data to the parent thread
-            wx.PostEvent(self._notify_window, ResultEvent(data=data))
+        try:
+            # peek at the abort variable once in a while to see if we
+            # should stop
+            for data in self.gen:
+                if self._want_abort:
+                    break
+                # Send data to the parent thread
+                if self.batched:
+                    self.deliver(data)
+                else:
+                    wx.PostEvent(self._notify_window,
+                                 ResultEvent(data=data, items=[data]))
+        finally:
+            # let the generator clean up (stop background acquisitions,
+            # release tasks) now, rather than whenever it is collected
+            if self.close_gen and hasattr(self.gen, 'close'):
+                self.gen.close()
+        if self.batched:
+            # collect the rest, and stop listening
+            wx.PostEvent(self._notify_window,
+                         WakeupEvent(worker=self, final=True))
         # Signal that we are all done
         elapsed = time() - start
         wx.PostEvent(self._notify_window, FinishedEvent(elapsed=elapsed))
 
+    def deliver(self, data):
+        """ queue a result, waking up the GUI if need be """
+        with self.lock:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(data)
+            wake = not self._awake
+            self._awake = True
+        if wake:
+            wx.PostEvent(self._notify_window,
+                         WakeupEvent(worker=self, final=False))
+
+    def on_wakeup(self, event):
+        """ in the GUI thread: collect the queued results """
+        if event.worker is not self:
+            event.Skip()  # another worker's
+            return
+        with self.lock:
+            items = list(self.pending)
+            self.pending.clear()
+            self._awake = False
+        if event.final:
+            self._notify_window.Unbind(EVT_WAKEUP, handler=self.on_wakeup)
+        if items:
+            result = ResultEvent(data=items[-1], items=items)
+            self._notify_window.GetEventHandler().ProcessEvent(result)
+
     def abort(self):
         """abort worker thread."""
         # Method for use by main thread to signal an abort
@@ -76,19 +348,21 @@ class WorkerThread(threading.Thread):
 
 class MonitorWindow(wx.Frame):
 
-    def __init__(self, parent, title, datagen=None):
+    def __init__(self, parent, title, datagen=None, max_fps=30):
         wx.Frame.__init__(self, parent, title=title, size=(500,400))
 
         if datagen is None:
             datagen = silly_gen()
 
         self.statusbar = self.CreateStatusBar()
-        self.panel = MonitorPanel(self, datagen)
+        self.panel = MonitorPanel(self, datagen, max_fps=max_fps)
         self.save_to_dir = os.path.expanduser('~')
 
         filemenu = wx.Menu()
         menuExit = filemenu.Append(wx.ID_EXIT, "E&xit", " Stop program")
         menuSave = filemenu.Append(wx.ID_SAVE, "&Save", " Save a file")
+        self.menuRecord = filemenu.Append(wx.ID_ANY, "&Record...",
+                " Record to disk as data comes in")
 
         menuBar = wx.MenuBar()
         menuBar.Append(filemenu, "&File")
@@ -96,6 +370,8 @@ class MonitorWindow(wx.Frame):
 
         self.Bind(wx.EVT_MENU, self.OnExit, menuExit)
         self.Bind(wx.EVT_MENU, self.OnSave, menuSave)
+        self.Bind(wx.EVT_MENU, self.OnRecord, self.menuRecord)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
 
         # shortcuts
         shortcuts = wx.AcceleratorTable([
@@ -123,17 +399,57 @@ class MonitorWindow(wx.Frame):
             n.save(path, xy)
             self.statusbar.SetStatusText('Saved %s' % path)
 
+    def OnRecord(self, e):
+        recorder = self.panel.recorder
+        if recorder is not None:
+            self.panel.recorder = None
+            recorder.close()
+            self.menuRecord.SetItemLabel("&Record...")
+            self.statusbar.SetStatusText('Recorded %d points to %s'
+                                         % (recorder.rows, recorder.path))
+            return
+        dlg = wx.FileDialog(self,
+                message="Record to file",
+                defaultDir=self.save_to_dir,
+                defaultFile=get_next_filename(self.save_to_dir,
+                                              fmt="monitor%03d.rec"),
+                wildcard="Recordings (*.rec)|*.rec",
+                style=wx.FD_SAVE)
+        if dlg.ShowModal() == wx.ID_OK:
+            self.save_to_dir = dlg.GetDirectory()
+            path = dlg.GetPath()
+            try:
+                self.panel.recorder = MonitorRecorder(path)
+            except (IOError, ValueError) as err:
+                self.statusbar.SetStatusText('Could not record: %s' % err)
+                return
+            self.menuRecord.SetItemLabel("Stop &Recording")
+            self.statusbar.SetStatusText('Recording to %s' % path)
+
+    def OnClose(self, e):
+        if self.panel.recorder is not None:
+            self.panel.recorder.close()
+            self.panel.recorder = None
+        e.Skip()
+
 
 class MonitorPanel(wx.Panel):
     """
     Panel encompassing a line monitor graph.
 
     Pulls x,y data from the provided generator `datagen`
-    and plots a live 2D graph.
+    and plots a live 2D graph. `datagen` may yield single points,
+    or blocks of points as a pair of arrays.
+
+    Incoming data is only stored; the plot is redrawn on a timer, at
+    most `max_fps` times a second, however fast the data comes in.
+    Only the line is redrawn, over a saved copy of the rest of the
+    plot, unless the data has gone outside the axis limits and they
+    need to be changed.
 
     """
 
-    def __init__(self, parent, datagen):
+    def __init__(self, parent, datagen, max_fps=30):
 
         wx.Panel.__init__(self, parent)
 
@@ -144,12 +460,18 @@ class MonitorPanel(wx.Panel):
 
         self.ax.xaxis.set_major_locator(ScrollingLocator())
 
-        # maintain x and y lists (we'll append to these as we go)
-        self.setup_deques([], [])
+        # maintain x and y buffers (we'll append to these as we go)
+        self.x = RingBuffer()
+        self.y = RingBuffer()
+        # summaries of them, so long histories plot quickly
+        self.levels = MinMaxLevels(self.x, self.y)
 
-        self.line, = self.ax.plot(self.x, self.y)
+        # the line is drawn separately, over the saved background
+        self.line, = self.ax.plot([], [], animated=True)
 
         self.canvas = FigureCanvasWxAgg(self, -1, fig)
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
         self.canvas.draw()
 
         self.checkbox = wx.CheckBox(self, label="Limit to")
@@ -183,6 +505,14 @@ class MonitorPanel(wx.Panel):
         self.running = False
         self.Bind(EVT_RESULT, self.on_result)
 
+        # if set, a record.MonitorRecorder that gets all incoming data
+        self.recorder = None
+
+        self.dirty = False  # new data since the last redraw
+        self.timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_timer, self.timer)
+        self.timer.Start(int(1000 / max_fps))
+
     def on_start_button(self, event):
         if not self.running:
             self.start_worker()
@@ -196,6 +526,8 @@ class MonitorPanel(wx.Panel):
     def on_clear_button(self, event):
         self.x.clear()
         self.y.clear()
+        self.levels.reset()
+        self.dirty = True
 
     def __del__(self):
         # this doesn't seem to work
@@ -206,37 +538,79 @@ class MonitorPanel(wx.Panel):
         self.worker.abort()
         self.worker.join()
 
-    def setup_deques(self, x, y, maxlen=None):
-        self.x = deque(x, maxlen)
-        self.y = deque(y, maxlen)
-
     def start_worker(self):
         self.worker = WorkerThread(self, self.datagen)
         self.worker.start()
 
     def on_result(self, event):
-        if event.data is None:
-            pass
-        else:
-            x,y = event.data
-
-            self.x.append(x)
-            self.y.append(y)
-
-            self.line.set_data(self.x, self.y)
-            self.ax.relim()
-            self.ax.autoscale_view()
-            self.canvas.draw()
+        # single points and blocks of them, all in one go
+        points = [data for data in event.items if data is not None]
+        if points:
+            x = n.concatenate([n.atleast_1d(x) for x, y in points])
+            y = n.concatenate([n.atleast_1d(y) for x, y in points])
+            self.x.extend(x)
+            self.y.extend(y)
+            if self.recorder is not None:
+                self.recorder.write(x, y)
+            self.dirty = True
+
+    def on_timer(self, event):
+        if not self.dirty:
+            return
+        self.dirty = False
+        self.levels.update()
+        rescaled = len(self.x) and self.rescale(*self.levels.bounds())
+        x, y = self.levels.decimate(self.ax.get_xlim(),
+                                    self.ax.bbox.width)
+        self.line.set_data(x, y)
+        if rescaled:
+            self.canvas.draw()  # on_draw puts the line back
+        elif self.background is not None:
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.line)
+            self.canvas.blit(self.ax.bbox)
+
+    def on_draw(self, event):
+        """ after a full redraw, save the background and add the line """
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.ax.draw_artist(self.line)
+
+    def rescale(self, xmin, xmax, ymin, ymax):
+        """
+        if the data, spanning these bounds, has gone outside the axis
+        limits, or shrunk well inside them (old samples dropped off the
+        start, or the signal settled down), set new ones with some room
+        to grow, and return True
+        """
+        x0, x1 = self.ax.get_xlim()
+        y0, y1 = self.ax.get_ylim()
+        xpad = .1 * (xmax - xmin) or 1.
+        ypad = .05 * (ymax - ymin) or .05 * abs(ymax) or 1.
+        inside = x0 <= xmin and xmax <= x1 and y0 <= ymin and ymax <= y1
+        # leave some slack before shrinking, so as not to redraw the
+        # whole plot on every tick once samples start dropping off.
+        # compare with the padded span we would set, so that a flat
+        # trace doesn't look shrunk again straight after a rescale
+        shrunk = (xmin > x0 + .1 * (x1 - x0) or
+                  ymax - ymin + 2 * ypad < .5 * (y1 - y0))
+        if inside and not shrunk:
+            return False
+        self.ax.set_xlim(xmin, xmax + xpad)
+        self.ax.set_ylim(ymin - ypad, ymax + ypad)
+        return True
 
     def impose_limit(self, event):
         if self.checkbox.IsChecked():
-            maxlen = self.spinbox.GetValue()
+            maxlen = int(self.spinbox.GetValue())
         else:
             maxlen = None
-        self.setup_deques(self.x, self.y, maxlen=maxlen)
+        self.x.resize(maxlen)
+        self.y.resize(maxlen)
+        self.levels.reset()
+        self.dirty = True
 
     def get_data(self):
-        return self.line.get_data()
+        return self.x.view(), self.y.view()
 
 
 if __name__ == "__main__":
@@ -262,11 +636,21 @@ if __name__ == "__main__":
         from .expt import gen_gated_counts
         gen = gen_gated_counts(t=0.1)
         title += ' (gated)'
+    elif '--stream' in sys.argv:
+        from .expt import gen_count_stream
+        gen = gen_count_stream(t=0.001, nsamps=100,
+                               pulsechan=pulsechan, countchan=countchan)
+        title += ' (stream)'
     else:
         from .expt import gen_count_rate
         gen = gen_count_rate(t=0.1, pulsechan=pulsechan, countchan=countchan)
 
     app = wx.App(False)
-    frame = MonitorWindow(None, title, datagen=gen)
+    frame = MonitorWindow(None, title, datagen=gen,
+                          max_fps=cfg.getfloat('monitor', 'max_fps'))
     frame.Show(True)
     app.MainLoop()
+
+    if not fake:
+        from .expt import tasks
+        tasks.clear()
@@ -0,0 +1,248 @@
+import numpy as n
+
+def galvo_codes(galvo, vals):
+    """ raw DAC codes for `vals`, as `galvo` would write them """
+    if hasattr(galvo, 'codes'):
+        return galvo.codes(vals)
+    return n.asarray(vals, dtype=n.int16)
+
+def progressive_order(ny, nx, coarse=16):
+    """
+    the pixels of an ny by nx grid, as raster indices, in
+    coarse-to-fine order: every s-th pixel of every s-th line first,
+    for the largest power of two s that leaves at least `coarse`
+    pixels across, then every s/2-th and so on down to every pixel,
+    each pass skipping the pixels already visited.
+
+    Returns (order, strides): the indices, and the stride of each
+    pass.
+    """
+    stride = 1
+    while max(ny, nx) // (2 * stride) >= coarse:
+        stride *= 2
+    strides = []
+    while stride:
+        strides.append(stride)
+        stride //= 2
+    iy, ix = n.mgrid[:ny, :nx]
+    visited = n.zeros((ny, nx), dtype=bool)
+    order = []
+    for stride in strides:
+        todo = (iy % stride == 0) & (ix % stride == 0) & ~visited
+        visited |= todo
+        order.append(n.flatnonzero(todo))
+    return n.concatenate(order), strides
+
+def select_tiles(coarse, threshold=0, contrast=0, grow=1):
+    """
+    which pixels of a coarse scan are worth refining: those brighter
+    than `threshold`, or differing from the mean of their neighbours
+    by more than `contrast` times that mean. Those within `grow`
+    pixels of one are included too, so as not to cut features off at
+    the edges. Returns a boolean array like `coarse`.
+    """
+    coarse = n.nan_to_num(coarse)
+    ny, nx = coarse.shape
+    keep = n.zeros(coarse.shape, dtype=bool)
+    if threshold:
+        keep |= coarse > threshold
+    if contrast:
+        padded = n.pad(coarse, 1, mode='edge')
+        total = -coarse
+        for dy in range(3):
+            for dx in range(3):
+                total = total + padded[dy:dy + ny, dx:dx + nx]
+        mean = total / 8
+        keep |= n.abs(coarse - mean) > contrast * mean
+    for k in range(grow):
+        padded = n.pad(keep, 1, mode='constant')
+        for dy in range(3):
+            for dx in range(3):
+                keep = keep | padded[dy:dy + ny, dx:dx + nx]
+    return keep
+
+def refine_pixels(keep, shape, stride):
+    """
+    raster indices of the pixels of a grid of `shape` that lie in the
+    tiles `keep` of a coarse scan of every `stride`-th pixel, apart
+    from the coarse samples themselves
+    """
+    ny, nx = shape
+    fine = n.repeat(n.repeat(keep, stride, 0), stride, 1)[:ny, :nx]
+    fine[::stride, ::stride] = False
+    return n.flatnonzero(fine)
+
+class SettleModel(object):
+    """
+    How long a galvo takes to settle after a move: `fixed` seconds for
+    any move at all, plus `per_code` seconds for each DAC code moved.
+    """
+
+    def __init__(self, fixed=0., per_code=0.):
+        self.fixed = fixed
+        self.per_code = per_code
+
+    def __repr__(self):
+        return 'SettleModel(fixed=%g, per_code=%g)' % (self.fixed,
+                                                       self.per_code)
+
+    def __nonzero__(self):
+        return bool(self.fixed or self.per_code)
+    __bool__ = __nonzero__
+
+    def delay(self, steps):
+        """ settling time after moves of `steps` codes (0 if none) """
+        steps = n.abs(n.asarray(steps, dtype=float))
+        return n.where(steps > 0, self.fixed + self.per_code * steps, 0.)
+
+    @classmethod
+    def from_config(cls, cfg, axis):
+        """
+        the model for `axis` ('x' or 'y') from the [settle] section of
+        `cfg`, where e.g. x_fixed overrides fixed for the x galvo
+        """
+        def get(name):
+            option = '%s_%s' % (axis, name)
+            if not cfg.has_option('settle', option):
+                option = name
+            return cfg.getfloat('settle', option)
+        return cls(get('fixed'), get('per_code'))
+
+class ScanPlan(object):
+    """
+    A 2D scan, compiled down to flat arrays.
+
+    Everything the scan loop needs is worked out once, up front:
+
+    xcodes, ycodes: the raw DAC code to write at each step (int16),
+        with each galvo's reversal and modulo wrap already applied
+    index: where in the (flattened) output image each step's result
+        belongs (uint32)
+    lines: step offsets of the start of each line, plus the total
+        number of steps at the end. Results are delivered a line at
+        a time.
+
+    If `serpentine` is True, every other line is scanned backward, so
+    that the x galvo never has to fly back across the whole field.
+    `index` still puts each result in raster order. `offset` is added
+    to X on the backward lines, to line them up with the forward ones
+    when the galvo lags behind its command.
+
+    Instead of every pixel in raster order, `pixels` can give the
+    raster indices of the pixels to visit, in order. Each run of
+    pixels on the same row is delivered as a line. If `progressive`
+    is True, the pixels are visited in coarse-to-fine passes (see
+    progressive_order). For scans like these, `strides` says which
+    coarse samples to fill in the gaps from (see preview).
+
+    `waits` is how long to let the galvos settle after each step's
+    move, according to the SettleModels `xsettle` and `ysettle`. The
+    first step is taken to follow the last, as it does when the scan
+    repeats.
+
+    """
+
+    def __init__(self, X, Y, xgalvo=None, ygalvo=None,
+                 serpentine=False, offset=0, progressive=False,
+                 pixels=None, strides=None,
+                 xsettle=None, ysettle=None):
+        X = n.asarray(X)
+        Y = n.asarray(Y)
+        ny, nx = len(Y), len(X)
+        self.X = X
+        self.Y = Y
+        self.shape = (ny, nx)
+        self.serpentine = serpentine
+        self.xcodes = n.tile(galvo_codes(xgalvo, X), ny)
+        self.ycodes = n.repeat(galvo_codes(ygalvo, Y), nx)
+        self.index = n.arange(ny * nx, dtype=n.uint32)
+        if serpentine:
+            back = galvo_codes(xgalvo, X[::-1] + offset)
+            xcodes = self.xcodes.reshape(ny, nx)
+            index = self.index.reshape(ny, nx)
+            xcodes[1::2] = back
+            index[1::2] = index[1::2, ::-1]
+        self.lines = n.arange(ny + 1) * nx
+        self.strides = [1]
+        if progressive:
+            pixels, strides = progressive_order(ny, nx)
+        if strides is not None:
+            self.strides = strides
+        if pixels is not None:
+            if serpentine:
+                raise ValueError("serpentine scans visit every pixel")
+            pixels = n.asarray(pixels, dtype=int)
+            rows = pixels // nx
+            self.xcodes = galvo_codes(xgalvo, X)[pixels % nx]
+            self.ycodes = galvo_codes(ygalvo, Y)[rows]
+            self.index = pixels.astype(n.uint32)
+            self.lines = n.concatenate(([0],
+                                        n.flatnonzero(n.diff(rows)) + 1,
+                                        [len(pixels)]))
+        self._preview = None
+        self.waits = n.zeros(len(self.index))
+        for codes, model in ((self.xcodes, xsettle),
+                             (self.ycodes, ysettle)):
+            if model:
+                codes = codes.astype(int)
+                moves = codes - n.roll(codes, 1)
+                n.maximum(self.waits, model.delay(moves), out=self.waits)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def nlines(self):
+        return len(self.lines) - 1
+
+    def line_slices(self):
+        """ a slice of the step arrays for each line """
+        return [slice(start, stop) for start, stop
+                in zip(self.lines[:-1], self.lines[1:])]
+
+    def preview(self, result):
+        """
+        `result`, with the pixels not scanned (nan) filled in from the
+        nearest coarser sample, for display while a progressive scan
+        is underway, or of a scan that was only refined in places
+        """
+        if len(self.strides) < 2:
+            return result
+        if self._preview is None:
+            ny, nx = self.shape
+            iy, ix = n.mgrid[:ny, :nx]
+            # for each pass but the last, the pixel each pixel's value
+            # comes from, finest first
+            self._sources = [(iy // s * s) * nx + (ix // s * s)
+                             for s in self.strides[-2::-1]]
+            self._preview = n.empty(self.shape)
+        out = self._preview
+        out[:] = result
+        flat = result.reshape(-1)
+        for sources in self._sources:
+            missing = n.isnan(out)
+            if not missing.any():
+                break
+            out[missing] = flat[sources[missing]]
+        return out
+
+    def ticks(self, t):
+        """
+        how many sample clock ticks of `t` seconds to spend on each
+        step in a hardware-timed scan: one, plus enough to cover the
+        step's settling time
+        """
+        return 1 + n.ceil(self.waits / t - 1e-9).astype(int)
+
+    def held(self, codes, reps=None):
+        """
+        `codes` with the last sample of each line repeated once, as
+        written by hardware-timed scans, so that a buffered counter
+        latches the end of the last pixel of each line. If given,
+        each step is first repeated `reps` times (see ticks).
+        """
+        ends = self.lines[1:]
+        if reps is not None:
+            codes = n.repeat(codes, reps)
+            ends = n.cumsum(reps)[ends - 1]
+        return n.insert(codes, ends, codes[ends - 1])
@@ -0,0 +1,115 @@
+"""
+Recording monitor data to disk as it comes in.
+
+A recording is a 16-byte header (the magic string ``CIRCAMON``, then
+the format version, the number of columns and the size of the header,
+as little-endian uint16, uint16 and uint32), followed by rows of
+little-endian float64s, one column each for t and the rate. Rows are
+appended a block at a time, so a recording can be added to later, and
+read back (even while it is being written) by memory-mapping it.
+
+"""
+import os
+import struct
+import threading
+import numpy as n
+
+MAGIC = b'CIRCAMON'
+VERSION = 1
+HEADER = struct.Struct('<8sHHI')
+DTYPE = n.dtype('<f8')
+
+def read_header(f):
+    """ the number of columns and size of the header of a recording """
+    header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("not a monitor recording")
+    magic, version, ncols, size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("not a monitor recording")
+    if version > VERSION:
+        raise ValueError("recording is version %d, newer than this "
+                         "reader (%d)" % (version, VERSION))
+    return ncols, size
+
+class MonitorRecorder(threading.Thread):
+    """
+    Appends (t, rate) data to the recording at `path`, starting one if
+    the file is empty or doesn't exist.
+
+    write() only queues the data, so it is cheap enough to call from
+    the GUI for every result; a background thread writes out whatever
+    is queued every `interval` seconds. close() writes out the rest.
+    `rows` counts the rows written so far.
+    """
+
+    def __init__(self, path, interval=1., ncols=2):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.interval = interval
+        self.ncols = ncols
+        self.rowsize = ncols * DTYPE.itemsize
+        self.pending = []
+        self.rows = 0
+        self.lock = threading.Lock()
+        self._done = threading.Event()
+
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size:
+            with open(path, 'r+b') as f:
+                ncols, start = read_header(f)
+                if ncols != self.ncols:
+                    raise ValueError("recording has %d columns, not %d"
+                                     % (ncols, self.ncols))
+                # drop any row left half-written
+                extra = (size - start) % self.rowsize
+                if extra:
+                    f.truncate(size - extra)
+                self.rows = (size - start) // self.rowsize
+        self.file = open(path, 'ab')
+        if not size:
+            self.file.write(HEADER.pack(MAGIC, VERSION, self.ncols,
+                                        HEADER.size))
+            self.file.flush()
+        self.start()
+
+    def write(self, *columns):
+        """ queue a row, or a block of rows, one argument per column """
+        block = n.column_stack([n.atleast_1d(c) for c in columns])
+        with self.lock:
+            self.pending.append(block.astype(DTYPE))
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """ write out everything queued so far """
+        with self.lock:
+            blocks, self.pending = self.pending, []
+        if blocks:
+            data = n.concatenate(blocks)
+            self.file.write(data.tobytes())
+            self.file.flush()
+            self.rows += len(data)
+
+    def close(self):
+        """ write out the rest, and close the file """
+        self._done.set()
+        self.join()
+        self.file.close()
+
+def load_record(path):
+    """
+    the rows of the recording at `path`, as an array with a column
+    each for t and the rate, memory-mapped from the file
+    """
+    with open(path, 'rb') as f:
+        ncols, start = read_header(f)
+    nrows = (os.path.getsize(path) - start) // (ncols * DTYPE.itemsize)
+    if not nrows:
+        return n.zeros((0, ncols), dtype=DTYPE)
+    return n.memmap(path, dtype=DTYPE, mode='r', offset=start,
+                    shape=(nrows, ncols))
@@ -256,7 +256,8 @@ class ScanPanel(wx.Panel):
 
     def start_scan(self, X, Y, t, **kwargs):
         scangen = self.scanfunc(X, Y, t, **kwargs)
-        self.worker = WorkerThread(self, scangen)
+        # each scan gets a fresh generator, so the worker can close it
+        self.worker = WorkerThread(self, scangen, close=True)
         self.worker.start()
 
     def abort_scan(self):
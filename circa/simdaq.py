@@ -0,0 +1,274 @@
+"""
+A simulated stand-in for the parts of PyDAQmx that circa uses.
+
+This lets the scan engines run (and be timed) on a machine without an
+NI card. Call ``install()`` before importing ``circa.expt`` or
+``circa.fast``, and they will pick this module up in place of PyDAQmx.
+
+Photons arrive at ``Task.photon_rate`` counts per second, and every
+driver call costs ``Task.latency`` seconds, which is roughly what a
+USB round trip to a 6008/6009 costs.
+
+Run ``python -m circa.simdaq`` for a pixels-per-second comparison of
+the software-timed and hardware-timed slow scan paths.
+
+"""
+from __future__ import print_function, division
+
+import sys
+import time
+import numpy as n
+# PyDAQmx re-exports numpy and these ctypes names, and callers that
+# do ``from PyDAQmx import *`` get them from there
+import numpy
+from ctypes import byref, c_long
+from ctypes import c_int16 as int16, c_int32 as int32, c_uint32 as uInt32
+
+DAQmx_Val_Volts = 10348
+DAQmx_Val_Seconds = 10364
+DAQmx_Val_Hz = 10373
+DAQmx_Val_Rising = 10280
+DAQmx_Val_Falling = 10171
+DAQmx_Val_CountUp = 10128
+DAQmx_Val_Low = 10214
+DAQmx_Val_High = 10192
+DAQmx_Val_DigLvl = 10152
+DAQmx_Val_FiniteSamps = 10178
+DAQmx_Val_ContSamps = 10123
+DAQmx_Val_GroupByChannel = 0
+DAQmx_Val_Task_Commit = 3
+DAQmx_Val_Task_Unreserve = 5
+DAQmx_Val_Auto = -1
+
+class DAQError(Exception):
+    pass
+
+def _setref(ref, value):
+    """ store `value` in a ctypes object, or a byref() to one """
+    getattr(ref, '_obj', ref).value = value
+
+# start times of running sample clocks, by terminal name
+_clocks = {}
+
+class Task(object):
+    """ a simulated DAQmx task """
+
+    latency = 0.
+    photon_rate = 1e5
+
+    def __init__(self):
+        self.kind = None
+        self.chans = []
+        self.rate = None
+        self.mode = None
+        self.samps = None
+        self.source = ''
+        self.duration = 0.
+        self.data = None
+        self._start = None
+        self._count = 0
+        self._read = 0
+
+    def _call(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _clock_name(self):
+        dev = self.chans[0].split('/')[0].lstrip('/')
+        if self.kind == 'ao':
+            return '/%s/ao/SampleClock' % dev
+        elif self.kind == 'co':
+            return '/%sInternalOutput' % self.chans[0].replace('ctr', 'Ctr')
+
+    # channel creation
+
+    def CreateAOVoltageChan(self, name, *args):
+        self.kind = 'ao'
+        self.chans.extend(name.split(','))
+
+    def CreateCICountEdgesChan(self, name, *args):
+        self.kind = 'ci'
+        self.chans.append(name)
+
+    def CreateCOPulseChanTime(self, name, assign, units, idle,
+                              delay, low, high):
+        self.kind = 'co'
+        self.chans.append(name)
+        self.delay = delay + low
+        self.duration = delay + low + high
+
+    def SetCOPulseHighTime(self, chan, high):
+        self.duration = self.delay + high
+
+    def CreateCOPulseChanFreq(self, name, assign, units, idle,
+                              delay, freq, duty):
+        self.kind = 'co'
+        self.chans.append(name)
+        self.rate = freq
+        self.mode = DAQmx_Val_ContSamps
+
+    # timing and triggering
+
+    def CfgSampClkTiming(self, source, rate, edge, mode, samps):
+        self.source = source
+        self.rate = rate
+        self.mode = mode
+        self.samps = samps
+
+    def CfgImplicitTiming(self, mode, samps):
+        self.mode = mode
+        self.samps = samps
+
+    def SetPauseTrigType(self, val):
+        pass
+
+    def SetDigLvlPauseTrigSrc(self, val):
+        pass
+
+    def SetDigLvlPauseTrigWhen(self, val):
+        pass
+
+    def TaskControl(self, action):
+        self._call()
+
+    # running
+
+    def StartTask(self):
+        self._call()
+        if self._start is not None:
+            raise DAQError("task is already running")
+        self._start = time.time()
+        self._read = 0
+        if self.kind in ('ao', 'co') and self.rate:
+            _clocks[self._clock_name()] = self._start
+
+    def StopTask(self):
+        self._call()
+        if self.kind in ('ao', 'co') and self.rate:
+            _clocks.pop(self._clock_name(), None)
+        self._start = None
+
+    def ClearTask(self):
+        self.StopTask()
+
+    def _done_at(self):
+        if self.rate and self.mode == DAQmx_Val_FiniteSamps:
+            return self._start + self.samps / self.rate
+        elif self.mode == DAQmx_Val_ContSamps:
+            return None
+        return self._start + self.duration
+
+    def IsTaskDone(self, ref):
+        done_at = self._done_at()
+        _setref(ref, done_at is not None and time.time() >= done_at)
+
+    def WaitUntilTaskDone(self, timeout):
+        self._call()
+        done_at = self._done_at()
+        if done_at is None:
+            raise DAQError("continuous task never finishes")
+        wait = done_at - time.time()
+        if wait > timeout:
+            raise DAQError("timed out waiting for task")
+        if wait > 0:
+            time.sleep(wait)
+
+    # writing
+
+    def WriteRaw(self, samps, autostart, timeout, data, written, reserved):
+        self._call()
+        _setref(written, samps)
+
+    def WriteBinaryI16(self, samps, autostart, timeout, layout,
+                       data, written, reserved):
+        self._call()
+        self.data = n.array(data, dtype=n.int16).reshape(-1, samps)
+        _setref(written, samps)
+        if autostart:
+            self.StartTask()
+
+    # reading
+
+    def _photons(self, samps, dt):
+        counts = n.random.poisson(self.photon_rate * dt, samps)
+        cumulative = self._count + n.cumsum(counts)
+        self._count = int(cumulative[-1]) if samps else self._count
+        return cumulative.astype(n.uint32)
+
+    def _available(self):
+        t0 = _clocks.get(self.source, self._start)
+        avail = int((time.time() - t0) * self.rate) - self._read
+        if self.mode == DAQmx_Val_FiniteSamps:
+            avail = min(avail, self.samps - self._read)
+        return max(avail, 0)
+
+    def GetReadAvailSampPerChan(self, ref):
+        self._call()
+        _setref(ref, self._available())
+
+    def ReadCounterU32(self, samps, timeout, data, size, read, reserved):
+        self._call()
+        if samps == DAQmx_Val_Auto:
+            samps = self._available()
+        if samps > size:
+            raise DAQError("read buffer is too small")
+        t0 = _clocks.get(self.source, self._start)
+        ready = t0 + (self._read + samps) / self.rate
+        wait = ready - time.time()
+        if wait > timeout:
+            raise DAQError("timed out waiting for samples")
+        if wait > 0:
+            time.sleep(wait)
+        data[:samps] = self._photons(samps, 1. / self.rate)
+        self._read += samps
+        _setref(read, samps)
+
+    def ReadCounterScalarU32(self, timeout, ref, reserved):
+        self._call()
+        elapsed = time.time() - self._start
+        self._count = 0
+        _setref(ref, int(self._photons(1, elapsed)[0]))
+
+
+def install():
+    """ make ``import PyDAQmx`` give this module instead """
+    sys.modules['PyDAQmx'] = sys.modules[__name__]
+
+
+def benchmark(nx=64, ny=16, t=1e-4, latency=1e-3):
+    """
+    time the software-timed and hardware-timed slow scan paths
+    against the simulator, printing pixels per second for each.
+    """
+    install()
+    Task.latency = latency
+
+    from .expt import GalvoPixel, scan, buffered_scan
+    from .slow import gen_plan
+    from .plan import ScanPlan
+
+    xgalvo = GalvoPixel("Dev2/ao0")
+    ygalvo = GalvoPixel("Dev2/ao1")
+    X = n.arange(nx)
+    Y = n.arange(ny)
+    npix = nx * ny
+    plan = ScanPlan(X, Y, xgalvo, ygalvo)
+
+    start = time.time()
+    for val in scan(gen_plan(plan, xgalvo, ygalvo), t,
+                    pulsechan="Dev1/ctr1", countchan="Dev1/ctr0"):
+        pass
+    elapsed = time.time() - start
+    print('software-timed: %8.0f px/s' % (npix / elapsed))
+
+    for frame in (False, True):
+        start = time.time()
+        for line in buffered_scan(plan, t, xgalvo, ygalvo,
+                                  countchan="Dev1/ctr0", frame=frame):
+            pass
+        elapsed = time.time() - start
+        label = 'buffered (%s):' % ('frame' if frame else 'line')
+        print('%-16s%8.0f px/s' % (label, npix / elapsed))
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,18 +1,67 @@
+import sys
 from time import sleep
+from timeit import default_timer as clock
 import itertools
 import numpy as n
 
+from .plan import ScanPlan, select_tiles, refine_pixels
+
 def fake_scan(gen, t=0.1, **kwargs):
     for step in gen:
         sleep(t)
         yield int(200000 * n.random.random())
 
-def gen_2D(X, Y, xgalvo, ygalvo):
-    for y in Y:
-        ygalvo.value = y
-        for x in X:
-            xgalvo.value = x
+def plan_steps(plan):
+    """
+    (xcode, ycode, wait) for each step of ``plan``, as Python numbers.
+    converted a line at a time, so a big frame never exists as
+    Python objects all at once.
+    """
+    for line in plan.line_slices():
+        for step in itertools.izip(plan.xcodes[line].tolist(),
+                                   plan.ycodes[line].tolist(),
+                                   plan.waits[line].tolist()):
+            yield step
+
+# sleep() can overshoot by a whole scheduler tick (as much as 15 ms
+# on Windows), so waits shorter than this are spun out instead
+SPIN = 2e-3
+
+def settle(wait):
+    """ wait for `wait` seconds, spinning if it is too short to sleep """
+    if wait >= SPIN:
+        sleep(wait)
+        return
+    end = clock() + wait
+    while clock() < end:
+        pass
+
+def gen_plan(plan, xgalvo, ygalvo):
+    """
+    move the galvos through the steps of ``plan``, yielding at each.
+    the y galvo is only written when its code changes, and galvos
+    sharing a GalvoPair are moved together in one write. after moves
+    that need it, waits for the galvos to settle (see plan.waits and
+    settle).
+    """
+    steps = plan_steps(plan)
+    pair = getattr(xgalvo, 'pair', None)
+    if pair is not None and pair is getattr(ygalvo, 'pair', None):
+        for x,y,wait in steps:
+            pair.set_codes(x, y)
+            if wait:
+                settle(wait)
             yield
+        return
+    lasty = None
+    for x,y,wait in steps:
+        if y != lasty:
+            ygalvo.set_code(y)
+            lasty = y
+        xgalvo.set_code(x)
+        if wait:
+            settle(wait)
+        yield
 
 def repeat_gen(gen, *args, **kwargs):
     """ repeatedly instantiate gen and run it to completion. """
@@ -22,34 +71,89 @@ def repeat_gen(gen, *args, **kwargs):
         for result in current:
             yield result
 
-def chunk(gen, n=1):
-    # not perfect unless n perfectly divides the lenght of gen
+def gen_lines(gen, plan):
+    """
+    group the per-step values from ``gen`` into an array per line of
+    ``plan``, repeating the plan for as long as gen keeps going.
+    """
     while True:
-        for i in xrange(n-1):
-            next(gen)
-        yield next(gen)
+        for line in plan.line_slices():
+            vals = list(itertools.islice(gen, line.stop - line.start))
+            if not vals:
+                return
+            yield n.array(vals)
 
-def yielding_fromiter(gen, result):
+def yielding_lines(gen, plan, result, dwell=None):
     """
-    fills the ND array ``result`` with values from the ``gen`` iterator,
-    yielding after each insertion so that you can do something else
-    (like incremental plotting).
+    fills the ND array ``result`` with a line of values at a time from
+    the ``gen`` iterator, at the locations given by ``plan``, yielding
+    after each line so that you can do something else (like
+    incremental plotting).
+
+    if ``dwell`` is given, gen yields lines of (value, dwell) pairs,
+    and the dwells go in the same places in ``dwell``.
 
     """
-    dimensions = [xrange(n) for n in result.shape]
-    coords = itertools.product(*dimensions)
-    coords = itertools.cycle(coords) # if gen keeps going, repeat
-    for loc,val in itertools.izip(coords,gen):
-        result[loc] = val
+    flat = result.reshape(-1)  # a view, for flat indexing
+    lines = itertools.cycle(plan.line_slices()) # if gen keeps going, repeat
+    if dwell is not None:
+        dwellflat = dwell.reshape(-1)
+    for line,vals in itertools.izip(lines,gen):
+        where = plan.index[line][:len(vals)]
+        if dwell is not None:
+            dwellflat[where] = vals[:,1]
+            vals = vals[:,0]
+        flat[where] = vals
         yield
 
-def make_generator_factory(xgalvo, ygalvo, pulsechan, countchan):
+def make_generator_factory(xgalvo, ygalvo, pulsechan, countchan,
+                           buffered=False, sampleclk=None,
+                           serpentine=False, line_offset=0,
+                           progressive=False,
+                           xsettle=None, ysettle=None,
+                           target=0, tick=1e-4,
+                           refine=0, threshold=0, contrast=0, grow=1):
     """
     given two galvonometer objects (xgalvo, ygalvo) and strings
     identifying the counter pair used for counting (pulsechan,
     countchan), return a function that would produce data generators for
     2D scans using those parameters.
+
+    if ``buffered`` is True, scans are hardware-timed: each line goes
+    out as one sample-clocked waveform, and counts are read back from
+    a buffered counter (see expt.buffered_scan). ``sampleclk`` then
+    optionally overrides the terminal the counter is clocked from.
+
+    if ``serpentine`` is True, alternate lines are scanned backward,
+    shifted by ``line_offset`` codes (see plan.ScanPlan). if
+    ``progressive`` is True, pixels are scanned coarse to fine, and the
+    returned function's ``preview(vector)`` gives the partial result
+    with the gaps filled in, for display. the two don't combine, so
+    ``serpentine`` is ignored (with a warning) if ``progressive`` is
+    also given.
+
+    ``xsettle`` and ``ysettle`` are plan.SettleModels giving how long
+    to wait for each galvo after it moves.
+
+    if ``target`` is nonzero, each pixel is counted only until that
+    many counts have come in, for at most the dwell time t of the scan
+    (see expt.adaptive_scan). The dwell of each pixel is kept, and the
+    returned function's ``saved()`` gives it for saving with the image.
+
+    if ``refine`` is more than 1, only every ``refine``-th pixel is
+    scanned at first. Then only the tiles around the pixels picked out
+    by plan.select_tiles (with ``threshold``, ``contrast`` and
+    ``grow``) are filled in at full resolution. The rest of the image
+    is filled from the coarse pixels, and ``saved()`` gives a
+    ``scanned`` mask of the pixels that were really measured.
     """
+    if serpentine and progressive:
+        sys.stderr.write('serpentine scans visit every pixel, so they '
+                         'can\'t be progressive; ignoring serpentine\n')
+        serpentine = False
+
+    last = {}  # extra arrays from the latest scan
+    current = {}  # the plan of the latest scan
 
     def make_data_generator(X, Y, t, vector, repeat=False):
         """
@@ -60,22 +164,94 @@ def make_generator_factory(xgalvo, ygalvo, pulsechan, countchan):
 
         # scan generator
         try:
-            from expt import scan
+            from expt import scan, adaptive_scan
         except NotImplementedError:
             scan = fake_scan
+            adaptive_scan = None
+
+        def datagen(plan, t, repeat):
+            if repeat:
+                gen = repeat_gen(gen_plan, plan, xgalvo, ygalvo)
+            else:
+                gen = gen_plan(plan, xgalvo, ygalvo)
+            gen = scan(gen, t, pulsechan=pulsechan, countchan=countchan)
+            return gen_lines(gen, plan)
 
-        def datagen(X, Y, t):
+        def adaptive_datagen(plan, t, repeat):
             if repeat:
-                gen = repeat_gen(gen_2D, X, Y, xgalvo, ygalvo)
+                gen = repeat_gen(gen_plan, plan, xgalvo, ygalvo)
             else:
-                gen = gen_2D(X, Y, xgalvo, ygalvo)
-            return scan(gen, t, pulsechan=pulsechan, countchan=countchan)
+                gen = gen_plan(plan, xgalvo, ygalvo)
+            gen = adaptive_scan(gen, target, tmax=t, tick=tick,
+                                pulsechan=pulsechan, countchan=countchan)
+            return gen_lines(gen, plan)
 
-        gen = chunk(yielding_fromiter(datagen(X, Y, t), vector),
-                n = vector.shape[-1])
+        def buffered_datagen(plan, t, repeat):
+            from expt import buffered_scan
+            while True:
+                for line in buffered_scan(plan, t, xgalvo, ygalvo,
+                                          countchan, sampleclk=sampleclk):
+                    yield line
+                if not repeat:
+                    break
 
-        return gen
+        last.clear()
+        dwell = None
+        if target and adaptive_scan is not None:
+            dwell = n.empty_like(vector)
+            dwell[:] = n.nan
+            last['dwell'] = dwell
+            datagen = adaptive_datagen
+        elif buffered:
+            datagen = buffered_datagen
 
-    return make_data_generator
+        def run(plan, repeat=repeat):
+            current['plan'] = plan
+            gen = datagen(plan, t, repeat)
+            return yielding_lines(gen, plan, vector, dwell=dwell)
 
+        def refined_scan():
+            shape = Y.shape + X.shape
+            strides = [refine, 1]
+            corners = n.zeros(shape, dtype=bool)
+            corners[::refine, ::refine] = True
+            while True:
+                vector[:] = n.nan
+                coarse = ScanPlan(X, Y, xgalvo, ygalvo,
+                                  pixels=n.flatnonzero(corners),
+                                  strides=strides,
+                                  xsettle=xsettle, ysettle=ysettle)
+                for _ in run(coarse, repeat=False):
+                    yield
+                keep = select_tiles(vector[::refine, ::refine],
+                                    threshold, contrast, grow)
+                fine = ScanPlan(X, Y, xgalvo, ygalvo,
+                                pixels=refine_pixels(keep, shape, refine),
+                                strides=strides,
+                                xsettle=xsettle, ysettle=ysettle)
+                if len(fine):
+                    for _ in run(fine, repeat=False):
+                        yield
+                scanned = corners.copy()
+                scanned.flat[fine.index] = True
+                last['scanned'] = scanned
+                last['refine'] = refine
+                vector[:] = fine.preview(vector)
+                yield
+                if not repeat:
+                    break
 
+        if refine > 1:
+            return refined_scan()
+
+        plan = ScanPlan(X, Y, xgalvo, ygalvo,
+                        serpentine=serpentine, offset=line_offset,
+                        progressive=progressive,
+                        xsettle=xsettle, ysettle=ysettle)
+        return run(plan)
+
+    make_data_generator.saved = lambda: dict(last)
+    if progressive or refine > 1:
+        make_data_generator.preview = (
+            lambda vector: current['plan'].preview(vector))
+    return make_data_generator